@@ -32,6 +32,55 @@ EXPIRE_DELTA_PUBLIC = getattr(settings, 'OAUTH_EXPIRE_DELTA_PUBLIC', timedelta(d
 
 EXPIRE_CODE_DELTA = getattr(settings, 'OAUTH_EXPIRE_CODE_DELTA', timedelta(seconds=10 * 60))
 
+# Dotted path to the storage backend for authorization codes.
+GRANT_STORAGE = getattr(settings, 'OAUTH_GRANT_STORAGE', 'provider.oauth2.storage.DatabaseGrantStorage')
+
+# Cache alias used by ``provider.oauth2.storage.CacheGrantStorage``.
+GRANT_CACHE = getattr(settings, 'OAUTH_GRANT_CACHE', 'default')
+
+# Dotted path to the storage backend for access and refresh tokens.
+TOKEN_STORAGE = getattr(settings, 'OAUTH_TOKEN_STORAGE', 'provider.oauth2.storage.DatabaseTokenStorage')
+
+# Cache alias and refresh token lifetime used by
+# ``provider.oauth2.storage.CacheTokenStorage``.
+TOKEN_STORAGE_CACHE = getattr(settings, 'OAUTH_TOKEN_STORAGE_CACHE', 'default')
+TOKEN_STORAGE_REFRESH_TIMEOUT = getattr(settings, 'OAUTH_TOKEN_STORAGE_REFRESH_TIMEOUT', timedelta(days=30))
+
+# Tokens issued for a lifetime below this are kept in the cache only by
+# ``provider.oauth2.storage.TieredTokenStorage``.
+TOKEN_STORAGE_CACHE_THRESHOLD = getattr(settings, 'OAUTH_TOKEN_STORAGE_CACHE_THRESHOLD', timedelta(days=1))
+
+# Values of ``AccessToken.type`` recording where a token is stored.
+DATABASE_TOKEN = 0
+CACHED_TOKEN = 1
+
+# Partition the access token table by month of expiry on PostgreSQL 11+.
+# Must be set before migrating, see ``provider.oauth2.partitions``.
+PARTITION_TOKENS = getattr(settings, 'OAUTH_PARTITION_TOKENS', False)
+
+# How far before its previous run ``clean_tokens`` rescans. Invalidated grants
+# and tokens get an expiry one day in the past.
+CLEANUP_OVERLAP = getattr(settings, 'OAUTH_CLEANUP_OVERLAP', timedelta(days=1, hours=1))
+
+# Seconds between runs of the in-process reaper removing expired grants and
+# tokens, see ``provider.oauth2.reaper``. ``0`` disables it.
+REAPER_INTERVAL = getattr(settings, 'OAUTH_REAPER_INTERVAL', 0)
+REAPER_BATCH_SIZE = getattr(settings, 'OAUTH_REAPER_BATCH_SIZE', 500)
+
+# Seconds a single reaper run may spend deleting rows.
+REAPER_BUDGET = getattr(settings, 'OAUTH_REAPER_BUDGET', 1.0)
+
+# Cache alias holding the lease that elects one reaper across processes.
+REAPER_CACHE = getattr(settings, 'OAUTH_REAPER_CACHE', 'default')
+
+# Record when access tokens were last used by the middleware. Times are
+# buffered per process and written in bulk every
+# ``LAST_USED_FLUSH_INTERVAL`` seconds or once ``LAST_USED_BUFFER_SIZE``
+# tokens are buffered, see ``provider.oauth2.usage``.
+TRACK_LAST_USED = getattr(settings, 'OAUTH_TRACK_LAST_USED', False)
+LAST_USED_FLUSH_INTERVAL = getattr(settings, 'OAUTH_LAST_USED_FLUSH_INTERVAL', 60)
+LAST_USED_BUFFER_SIZE = getattr(settings, 'OAUTH_LAST_USED_BUFFER_SIZE', 10000)
+
 # Remove expired tokens immediately instead of letting them persist.
 DELETE_EXPIRED = getattr(settings, 'OAUTH_DELETE_EXPIRED', False)
 
@@ -40,6 +89,17 @@ ENFORCE_CLIENT_SECURE = getattr(settings, 'OAUTH_ENFORCE_CLIENT_SECURE', True)
 
 SESSION_KEY = getattr(settings, 'OAUTH_SESSION_KEY', 'oauth')
 
+# Carry the authorization flow state in a signed cookie instead of the session
+# to avoid session writes during authorization.
+SESSIONLESS_AUTHORIZATION = getattr(settings, 'OAUTH_SESSIONLESS_AUTHORIZATION', False)
+
+STATE_COOKIE_NAME = getattr(settings, 'OAUTH_STATE_COOKIE_NAME', 'oauth_state')
+
+# Cache alias used to look up clients by ``client_id`` during the
+# authorization flow. ``None`` always reads clients from the database.
+CLIENT_CACHE = getattr(settings, 'OAUTH_CLIENT_CACHE', None)
+CLIENT_CACHE_TIMEOUT = getattr(settings, 'OAUTH_CLIENT_CACHE_TIMEOUT', 300)
+
 SINGLE_ACCESS_TOKEN = getattr(settings, 'OAUTH_SINGLE_ACCESS_TOKEN', False)
 
 LOGO_FOLDER = getattr(settings, 'OAUTH2_LOGO_FOLDER', 'logos')
@@ -51,3 +111,56 @@ LIMIT_NUM_REFRESH_TOKEN = getattr(settings, 'OAUTH_LIMIT_NUM_REFRESH_TOKEN', 0)
 
 # Do not invalidate the refresh token when using the it to refresh access token
 KEEP_REFRESH_TOKEN = getattr(settings, 'OAUTH_KEEP_REFRESH_TOKEN', False)
+
+# Invalidate every token issued from the same grant when an already rotated
+# refresh token is presented again.
+REVOKE_FAMILY_ON_REUSE = getattr(settings, 'OAUTH_REVOKE_FAMILY_ON_REUSE', False)
+
+# Regular expressions matched against ``request.path_info`` to decide which
+# requests ``provider.oauth2.middleware.AuthenticationMiddleware`` looks for
+# access tokens on. An empty include list matches every path.
+MIDDLEWARE_INCLUDE_PATHS = getattr(settings, 'OAUTH_MIDDLEWARE_INCLUDE_PATHS', ())
+MIDDLEWARE_EXCLUDE_PATHS = getattr(settings, 'OAUTH_MIDDLEWARE_EXCLUDE_PATHS', ())
+
+# Cache alias used to remember validated access tokens so that authenticated
+# requests can skip the database. ``None`` disables the token cache.
+TOKEN_CACHE = getattr(settings, 'OAUTH_TOKEN_CACHE', None)
+
+# Upper bound in seconds for how long a validated token is cached.
+TOKEN_CACHE_TIMEOUT = getattr(settings, 'OAUTH_TOKEN_CACHE_TIMEOUT', 60)
+
+# Number of password grants allowed to verify credentials at the same time in
+# one process. Password hashing is deliberately expensive, bounding it keeps
+# login spikes from starving every other request. 0 means no limit.
+PASSWORD_HASH_CONCURRENCY = getattr(settings, 'OAUTH_PASSWORD_HASH_CONCURRENCY', 0)
+
+# Number of password grants allowed to wait for a free slot before new ones are
+# rejected, and how many seconds each of them may wait.
+PASSWORD_HASH_QUEUE_DEPTH = getattr(settings, 'OAUTH_PASSWORD_HASH_QUEUE_DEPTH', 0)
+PASSWORD_HASH_TIMEOUT = getattr(settings, 'OAUTH_PASSWORD_HASH_TIMEOUT', 5)
+
+# Cache alias used to count login failures and rate limits. Falls back to a
+# process local in-memory cache if it is not configured.
+THROTTLING_CACHE = getattr(settings, 'OAUTH_THROTTLING_CACHE', 'default')
+
+# Number of failed password grants per username, client and remote address
+# within LOGIN_FAILURE_WINDOW after which further attempts are rejected
+# without checking the password. 0 disables the respective limit.
+LOGIN_FAILURE_LIMIT_USERNAME = getattr(settings, 'OAUTH_LOGIN_FAILURE_LIMIT_USERNAME', 0)
+LOGIN_FAILURE_LIMIT_CLIENT = getattr(settings, 'OAUTH_LOGIN_FAILURE_LIMIT_CLIENT', 0)
+LOGIN_FAILURE_LIMIT_IP = getattr(settings, 'OAUTH_LOGIN_FAILURE_LIMIT_IP', 0)
+LOGIN_FAILURE_WINDOW = getattr(settings, 'OAUTH_LOGIN_FAILURE_WINDOW', timedelta(minutes=5))
+
+# Token bucket limits for the token endpoint as ``{key: (rate, burst)}`` where
+# ``rate`` is requests per second and ``burst`` the bucket size. Keys are a
+# client's ``client_id``, ``'public'``, ``'confidential'`` or ``'default'``.
+CLIENT_RATE_LIMITS = getattr(settings, 'OAUTH_CLIENT_RATE_LIMITS', {})
+
+# Cache alias used to hand out the same client credentials token again for a
+# client and scope instead of creating a new one per request. ``None``
+# disables reuse.
+ISSUED_TOKEN_CACHE = getattr(settings, 'OAUTH_ISSUED_TOKEN_CACHE', None)
+
+# A client credentials token is only reused while it is valid for longer than
+# this.
+ISSUED_TOKEN_MIN_LIFETIME = getattr(settings, 'OAUTH_ISSUED_TOKEN_MIN_LIFETIME', timedelta(hours=1))
@@ -1,7 +1,7 @@
 import operator
 from django.contrib import admin
 from django import forms
-from .models import AccessToken, Grant, Client, RefreshToken
+from .models import AccessToken, Grant, Client, RefreshToken, Consent
 from .. import scope
 
 class ScopeMixin(object):
@@ -26,10 +26,14 @@ class ModelAdminForm(ScopeMixin, forms.ModelForm):
     pass
 
 class AccessTokenAdmin(admin.ModelAdmin):
-    list_display = ('user', 'client', 'token', 'expires',)
+    list_display = ('user', 'client', 'token', 'expires', 'is_deleted',)
+    list_filter = ('is_deleted',)
     raw_id_fields = ('user',)
     form = ModelAdminForm
 
+    def get_queryset(self, request):
+        return AccessToken.all_objects.all()
+
 
 class GrantAdmin(admin.ModelAdmin):
     list_display = ('user', 'client', 'code', 'expires',)
@@ -46,3 +50,4 @@ admin.site.register(AccessToken, AccessTokenAdmin)
 admin.site.register(Grant, GrantAdmin)
 admin.site.register(Client, ClientAdmin)
 admin.site.register(RefreshToken)
+admin.site.register(Consent)
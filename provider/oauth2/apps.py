@@ -4,3 +4,11 @@ class Oauth2(AppConfig):
     name = 'provider.oauth2'
     label = 'oauth2'
     verbose_name = "Provider Oauth2"
+
+    def ready(self):
+        from django.core.signals import request_started, request_finished
+        from .reaper import start_reaper_on_request
+        from .usage import flush_usage
+        request_started.connect(start_reaper_on_request,
+                                dispatch_uid='provider.oauth2.reaper')
+        request_finished.connect(flush_usage, dispatch_uid='provider.oauth2.usage')
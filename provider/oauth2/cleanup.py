@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Set based removal of grants and tokens that can no longer be used.
+"""
+from __future__ import unicode_literals
+
+import time
+
+from django.db import connections, router
+
+from .models import AccessToken, Client, Grant, RefreshToken
+
+BATCH_SIZE = 1000
+
+
+def delete_in_batches(queryset, batch_size=BATCH_SIZE, deadline=None):
+    """
+    Delete the rows matched by ``queryset`` ``batch_size`` at a time with
+    plain ``DELETE ... WHERE id IN (...)`` statements, without loading model
+    instances, sending signals or following cascades. No new batch is
+    started after the ``time.time()`` value ``deadline``. Return the number
+    of rows deleted.
+    """
+    model = queryset.model
+    using = router.db_for_write(model)
+    deleted = 0
+
+    while deadline is None or time.time() < deadline:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        model._base_manager.filter(pk__in=pks)._raw_delete(using)
+        deleted += len(pks)
+        if len(pks) < batch_size:
+            break
+
+    return deleted
+
+
+def _without(queryset, column, related_model):
+    """
+    Anti-join restricting ``queryset`` to rows whose ``column`` references
+    no row of ``related_model``.
+    """
+    qn = connections[router.db_for_read(queryset.model)].ops.quote_name
+    where = 'NOT EXISTS (SELECT 1 FROM {related} WHERE {related}.{pk} = {table}.{column})'.format(
+        related=qn(related_model._meta.db_table),
+        pk=qn(related_model._meta.pk.column),
+        table=qn(queryset.model._meta.db_table),
+        column=qn(column))
+    return queryset.extra(where=[where])
+
+
+def get_expired(reference):
+    """
+    Return ``(name, queryset)`` pairs of rows that expired before
+    ``reference``, ordered so that rows are removed before the rows they
+    reference. Refresh tokens of expired access tokens are included as
+    deleting the access tokens through the ORM cascades to them.
+    """
+    return [
+        ('refresh tokens', RefreshToken.objects.filter(expired=True)),
+        ('refresh tokens of expired access tokens',
+         RefreshToken.objects.filter(access_token__expires__lt=reference)),
+        ('grants', Grant.objects.filter(expires__lt=reference)),
+        ('access tokens', AccessToken.all_objects.filter(expires__lt=reference)),
+    ]
+
+
+def get_orphans():
+    """
+    Return ``(name, queryset)`` pairs of orphaned rows, ordered so that rows
+    are removed before the rows they reference.
+    """
+    return [
+        ('refresh tokens of deleted clients',
+         _without(RefreshToken.objects.all(), 'client_id', Client)),
+        ('refresh tokens of deleted access tokens',
+         RefreshToken.objects.filter(access_token__is_deleted=True)),
+        ('refresh tokens without access token',
+         _without(RefreshToken.objects.all(), 'access_token_id', AccessToken)),
+        ('access tokens of deleted clients',
+         _without(AccessToken.all_objects.all(), 'client_id', Client)),
+        ('deleted access tokens',
+         AccessToken.all_objects.filter(is_deleted=True)),
+        ('grants of deleted clients',
+         _without(Grant.objects.all(), 'client_id', Client)),
+    ]
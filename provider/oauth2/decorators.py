@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from functools import wraps
+
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.utils.decorators import available_attrs
+from django.utils.translation import ugettext as _
+
+from .. import scope as scopes
+from ..compat.http import JsonResponse
+from .middleware import get_token, _get_access_token
+
+
+def _to_mask(required):
+    """
+    Turn a mix of scope names and integer masks into a single scope mask.
+    Unknown names raise :class:`ImproperlyConfigured` instead of silently
+    requiring no scope at all.
+    """
+    mask = 0
+    for value in required:
+        if isinstance(value, (int, long)):
+            mask |= value
+            continue
+        names = value.split()
+        unknown = [name for name in names if name not in scopes.SCOPE_NAME_DICT]
+        if unknown:
+            raise ImproperlyConfigured(
+                "Unknown scope names: {}".format(', '.join(unknown)))
+        mask |= scopes.to_int(*names)
+    return mask
+
+
+def check_scope(request, wants):
+    """
+    Check the access token presented with ``request`` against the scope
+    mask ``wants``. Return ``None`` if the token grants the scope or an error
+    response as outlined in :rfc:`6750#section-3.1` otherwise. Requests
+    without any access token get a bare challenge without an error code.
+    """
+    token = get_token(request)
+
+    if token is None and _get_access_token(request) is None:
+        response = HttpResponse(status=401)
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+
+    if token is None:
+        response = JsonResponse({
+            'error': 'invalid_token',
+            'error_description': _("No valid access token was supplied.")},
+            status=401)
+        response['WWW-Authenticate'] = 'Bearer error="invalid_token"'
+        return response
+
+    if not token.has_scope(wants):
+        response = JsonResponse({
+            'error': 'insufficient_scope',
+            'error_description': _("The access token does not grant the "
+                "required scope.")},
+            status=403)
+        response['WWW-Authenticate'] = 'Bearer error="insufficient_scope"'
+        return response
+
+    return None
+
+
+def require_scope(*required):
+    """
+    Decorator for resource views that require an access token with the given
+    scope. Scopes can be given as names (``'read'``, ``'read write'``) or as
+    integer masks. The check reuses the token already loaded by
+    :class:`provider.oauth2.middleware.AuthenticationMiddleware`.
+
+    :example:
+
+    ::
+
+        @require_scope('write')
+        def update_profile(request):
+            ...
+    """
+    wants = _to_mask(required)
+
+    def decorator(view_func):
+        @wraps(view_func, assigned=available_attrs(view_func))
+        def _wrapped_view(request, *args, **kwargs):
+            response = check_scope(request, wants)
+            if response is not None:
+                return response
+            return view_func(request, *args, **kwargs)
+        return _wrapped_view
+    return decorator
+
+
+class ScopeRequiredMixin(object):
+    """
+    Class based view counterpart of :func:`require_scope`. Set
+    :attr:`required_scope` to a scope name, a space separated list of names
+    or an integer mask. Unknown names are reported by :meth:`as_view`.
+    """
+    required_scope = None
+
+    @staticmethod
+    def _required_mask(required):
+        if not isinstance(required, (list, tuple)):
+            required = (required,) if required is not None else ()
+        return _to_mask(required)
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        cls._required_mask(initkwargs.get('required_scope', cls.required_scope))
+        return super(ScopeRequiredMixin, cls).as_view(**initkwargs)
+
+    def dispatch(self, request, *args, **kwargs):
+        response = check_scope(request, self._required_mask(self.required_scope))
+        if response is not None:
+            return response
+        return super(ScopeRequiredMixin, self).dispatch(request, *args, **kwargs)
@@ -6,12 +6,12 @@ from django.contrib.auth import authenticate
 from django.utils.encoding import smart_text
 from django.utils.translation import ugettext as _
 
-from .. import scope
+from .. import constants, scope
 from ..constants import RESPONSE_TYPE_CHOICES, SCOPES
 from ..compat import get_user_model
 from ..forms import OAuthForm, OAuthValidationError
-from ..utils import now
-from .models import Client, Grant, RefreshToken
+from .models import Client, Grant
+from .storage import get_grant_storage, get_token_storage
 
 
 class ClientForm(forms.ModelForm):
@@ -216,11 +216,16 @@ class AuthorizationRequestForm(ScopeMixin, OAuthForm):
         redirect_uri = self.cleaned_data.get('redirect_uri')
 
         if redirect_uri:
-            if redirect_uri not in self.client.redirect_uri.split(" "):
+            if not self.client.redirect_uris.match(redirect_uri):
                 raise OAuthValidationError({
                     'error': 'invalid_request',
                     'error_description': _("The requested redirect didn't "
                         "match the client settings.")})
+        elif self.client.redirect_uris.default is None:
+            raise OAuthValidationError({
+                'error': 'invalid_request',
+                'error_description': _("A redirect_uri is required for this "
+                    "client.")})
 
         return redirect_uri
 
@@ -256,13 +261,19 @@ class RefreshTokenGrantForm(ScopeMixin, OAuthForm):
         if not token:
             raise OAuthValidationError({'error': 'invalid_request'})
 
-        try:
-            token = RefreshToken.objects.get(token=token,
-                expired=False, client=self.client)
-        except RefreshToken.DoesNotExist:
+        storage = get_token_storage()
+        refresh_token = storage.get_refresh_token(token, self.client)
+
+        if refresh_token is None:
+            if constants.REVOKE_FAMILY_ON_REUSE:
+                # a rotated refresh token is presented again, the family
+                # may be in the hands of an attacker
+                family = storage.get_rotated_family(token, self.client)
+                if family is not None:
+                    storage.invalidate_family(family)
             raise OAuthValidationError({'error': 'invalid_grant'})
 
-        return token
+        return refresh_token
 
     def clean(self):
         """
@@ -297,12 +308,13 @@ class AuthorizationCodeGrantForm(ScopeMixin, OAuthForm):
         if not code:
             raise OAuthValidationError({'error': 'invalid_request'})
 
-        try:
-            self.cleaned_data['grant'] = Grant.objects.get(
-                code=code, client=self.client, expires__gt=now())
-        except Grant.DoesNotExist:
+        grant = get_grant_storage().get(code, self.client)
+
+        if grant is None:
             raise OAuthValidationError({'error': 'invalid_grant'})
 
+        self.cleaned_data['grant'] = grant
+
         return code
 
     def clean(self):
@@ -365,6 +377,10 @@ class EmailAndPasswordGrantForm(ScopeMixin, OAuthForm):
     Validate the password of a user on a email_and_password grant
     request. Modified from PasswordGrantForm to use email addresses
     in place of usernames.
+
+    The user is fetched by email once and the password is checked against
+    that instance, so the user model's ``email`` column should be indexed.
+    Authentication backends other than the password check are not consulted.
     """
     email = forms.CharField(required=False)
     username = forms.CharField(required=False)
@@ -379,11 +395,11 @@ class EmailAndPasswordGrantForm(ScopeMixin, OAuthForm):
 
         User = get_user_model()
         try:
-            user = User.objects.get(email=email)
+            self.user = User._default_manager.get(email=email)
         except User.DoesNotExist:
             raise OAuthValidationError({'error': 'invalid_request'})
 
-        return user.username
+        return self.user.get_username()
 
     def clean_password(self):
         password = self.cleaned_data.get('password')
@@ -396,10 +412,9 @@ class EmailAndPasswordGrantForm(ScopeMixin, OAuthForm):
     def clean(self):
         data = self.cleaned_data
 
-        user = authenticate(username=data.get('username'),
-            password=data.get('password'))
+        user = getattr(self, 'user', None)
 
-        if user is None:
+        if user is None or not user.check_password(data.get('password')):
             raise OAuthValidationError({'error': 'invalid_grant'})
 
         data['user'] = user
@@ -4,16 +4,43 @@ from __future__ import unicode_literals
 from django.core.management.base import BaseCommand
 from django.utils.timezone import now
 
-from ...models import AccessToken, Grant, RefreshToken
+from .... import constants
+from ...models import AccessToken, Grant, RefreshToken, CleanupWatermark
 
 
 class Command(BaseCommand):
     help = 'Cleans up expires oauth2 rows'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true', dest='full', default=False,
+            help='Scan all rows instead of the range since the last run.')
+
     def handle(self, *args, **options):
+        reference = now()
         self._do_clean('refresh tokens', RefreshToken.objects.filter(expired=True))
-        self._do_clean('grants', Grant.objects.filter(expires__lt=now()))
-        self._do_clean('access tokens', AccessToken.objects.filter(expires__lt=now()))
+        self._do_clean_range('grants', Grant.objects.all(), reference,
+                             options['full'])
+        self._do_clean_range('access tokens', AccessToken.all_objects.all(),
+                             reference, options['full'])
+
+    def _do_clean_range(self, name, queryset, reference, full=False):
+        """
+        Only scan rows that expired since the previous run, minus
+        :attr:`provider.constants.CLEANUP_OVERLAP` for rows whose expiry was
+        moved back when they were invalidated.
+        """
+        watermark, created = CleanupWatermark.objects.get_or_create(name=name)
+
+        queryset = queryset.filter(expires__lt=reference)
+        if watermark.value is not None and not full:
+            queryset = queryset.filter(
+                expires__gte=watermark.value - constants.CLEANUP_OVERLAP)
+
+        self._do_clean(name, queryset)
+
+        watermark.value = reference
+        watermark.save(update_fields=['value', 'modified'])
 
     def _do_clean(self, name, queryset):
         self.stdout.write("Finding expired {}...".format(name), ending='')
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from ... import partitions
+from ....utils import now
+
+
+class Command(BaseCommand):
+    help = 'Creates upcoming and drops expired oauth2 access token partitions'
+
+    def handle(self, *args, **options):
+        if not partitions.supports_partitioning(connection):
+            self.stdout.write("Token partitioning is not supported, cleaning rows instead.")
+            call_command('clean_tokens', stdout=self.stdout)
+            return
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if not partitions.is_partitioned(cursor):
+                self.stdout.write("Access tokens are not partitioned, cleaning rows instead.")
+                call_command('clean_tokens', stdout=self.stdout)
+                return
+
+            reference = now()
+            created = partitions.create_partitions(
+                connection, cursor, reference,
+                partitions.last_needed_month(reference))
+            self.stdout.write("Created {:d} partitions".format(len(created)))
+
+            dropped = partitions.drop_expired_partitions(connection, cursor, reference)
+            self.stdout.write("Dropped {:d} expired partitions".format(len(dropped)))
+
+            removed = partitions.clean_default_partition(connection, cursor, reference)
+            self.stdout.write("Removed {:d} expired tokens from the default "
+                              "partition".format(removed))
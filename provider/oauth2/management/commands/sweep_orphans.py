@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from ... import cleanup
+
+
+class Command(BaseCommand):
+    help = 'Removes oauth2 rows left behind by deleted clients and tokens'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size',
+            default=cleanup.BATCH_SIZE,
+            help='Number of rows removed per statement.')
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only report how many rows would be removed.')
+
+    def handle(self, *args, **options):
+        for name, queryset in cleanup.get_orphans():
+            if options['dry_run']:
+                self.stdout.write("Found {:d} {}".format(queryset.count(), name))
+            else:
+                count = cleanup.delete_in_batches(queryset, options['batch_size'])
+                self.stdout.write("Removed {:d} {}".format(count, name))
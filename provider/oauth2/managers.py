@@ -3,9 +3,193 @@ from __future__ import unicode_literals
 
 from django.db import models
 
-from ..utils import now
+from .. import constants, scope as scopes
+from ..utils import now, get_cache
+from .principal import TokenPrincipal
+
+
+def token_cache_key(token):
+    return 'oauth2:token:{}'.format(token)
+
+
+def client_cache_key(client_id):
+    return 'oauth2:client:{}'.format(client_id)
+
+
+def issued_token_cache_key(client_id, scope):
+    return 'oauth2:issued:{}:{}'.format(client_id, scope)
+
+
+class ClientManager(models.Manager):
+    def get_by_client_id(self, client_id):
+        """
+        Return the client identified by ``client_id`` or ``None``. Clients are
+        served from :attr:`provider.constants.CLIENT_CACHE` when configured.
+        """
+        cache = get_cache(constants.CLIENT_CACHE)
+
+        if cache is not None:
+            client = cache.get(client_cache_key(client_id))
+            if client is not None:
+                return client
+
+        try:
+            client = self.get(client_id=client_id)
+        except self.model.DoesNotExist:
+            return None
+
+        if cache is not None:
+            cache.set(client_cache_key(client_id), client,
+                      constants.CLIENT_CACHE_TIMEOUT)
+        return client
+
+    def forget(self, client_id):
+        """
+        Drop ``client_id`` from the client cache.
+        """
+        cache = get_cache(constants.CLIENT_CACHE)
+        if cache is not None:
+            cache.delete(client_cache_key(client_id))
 
 
 class AccessTokenManager(models.Manager):
+    """
+    Default manager of :class:`provider.oauth2.models.AccessToken`. Soft
+    deleted tokens are left out of every query, use ``all_objects`` to
+    include them.
+    """
+    def get_queryset(self):
+        return super(AccessTokenManager, self).get_queryset().filter(
+            is_deleted=False)
+
     def get_token(self, token):
         return self.get(token=token, expires__gt=now())
+
+    def get_principal(self, token):
+        """
+        Return a :class:`provider.oauth2.principal.TokenPrincipal` for a live
+        access token that belongs to an active user, or ``None``. Only the
+        columns needed by the principal are fetched.
+
+        If :attr:`provider.constants.TOKEN_CACHE` is set the cache is consulted
+        first and the database is only queried on a miss.
+        """
+        cache = get_cache(constants.TOKEN_CACHE)
+        reference = now()
+
+        if cache is not None:
+            row = cache.get(token_cache_key(token))
+            if row is not None and row[1] is not None and row[4] > reference:
+                return TokenPrincipal(*row)
+
+        row = self.filter(token=token, expires__gt=reference,
+                          user__is_active=True).values_list(
+            'id', 'user', 'client', 'scope', 'expires').first()
+        if row is None:
+            return None
+
+        if cache is not None:
+            self._cache_principal(cache, token, row, reference)
+
+        return TokenPrincipal(*row)
+
+    def _cache_principal(self, cache, token, row, reference):
+        delta = row[4] - reference
+        timeout = min(constants.TOKEN_CACHE_TIMEOUT,
+                      delta.days * 86400 + delta.seconds)
+        if timeout > 0:
+            cache.set(token_cache_key(token), row, timeout)
+
+    def remember(self, access_token):
+        """
+        Put a freshly saved ``access_token`` into the token cache so that the
+        first :meth:`get_principal` does not have to query the database.
+        Tokens without a user are never cached as they do not authenticate.
+        """
+        cache = get_cache(constants.TOKEN_CACHE)
+        if cache is not None and access_token.user_id is not None:
+            self._cache_principal(cache, access_token.token, (
+                access_token.pk, access_token.user_id, access_token.client_id,
+                access_token.scope, access_token.expires), now())
+
+    def forget(self, token):
+        """
+        Drop ``token`` from the token cache.
+        """
+        cache = get_cache(constants.TOKEN_CACHE)
+        if cache is not None:
+            cache.delete(token_cache_key(token))
+
+    def get_issued(self, client, scope):
+        """
+        Return the client credentials token remembered for ``client`` and
+        ``scope`` through :meth:`remember_issued` if it is still valid for
+        longer than :attr:`provider.constants.ISSUED_TOKEN_MIN_LIFETIME`.
+        The token is rebuilt from the cache without touching the database.
+        """
+        cache = get_cache(constants.ISSUED_TOKEN_CACHE)
+        if cache is None:
+            return None
+
+        row = cache.get(issued_token_cache_key(client.pk, scope))
+        if row is None:
+            return None
+
+        pk, token, expires = row
+        if expires - constants.ISSUED_TOKEN_MIN_LIFETIME <= now():
+            return None
+
+        return self.model(pk=pk, token=token, expires=expires, scope=scope,
+                          client=client, user=None)
+
+    def remember_issued(self, access_token):
+        """
+        Remember a client credentials ``access_token`` until its remaining
+        lifetime drops to :attr:`provider.constants.ISSUED_TOKEN_MIN_LIFETIME`.
+        """
+        cache = get_cache(constants.ISSUED_TOKEN_CACHE)
+        if cache is None or access_token.user_id is not None:
+            return
+
+        delta = access_token.expires - constants.ISSUED_TOKEN_MIN_LIFETIME - now()
+        timeout = delta.days * 86400 + delta.seconds
+        if timeout > 0:
+            cache.set(issued_token_cache_key(access_token.client_id, access_token.scope),
+                      (access_token.pk, access_token.token, access_token.expires),
+                      timeout)
+
+    def forget_issued(self, access_token):
+        """
+        Stop handing out ``access_token`` from :meth:`get_issued`.
+        """
+        cache = get_cache(constants.ISSUED_TOKEN_CACHE)
+        if cache is None or access_token.user_id is not None:
+            return
+
+        key = issued_token_cache_key(access_token.client_id, access_token.scope)
+        row = cache.get(key)
+        if row is not None and row[0] == access_token.pk:
+            cache.delete(key)
+
+
+class ConsentManager(models.Manager):
+    def is_granted(self, user, client, scope):
+        """
+        Return ``True`` if ``user`` already granted ``client`` every bit of
+        ``scope``.
+        """
+        granted = self.filter(user=user, client=client).values_list(
+            'scope', flat=True).first()
+        return granted is not None and scopes.check(scope, granted)
+
+    def grant(self, user, client, scope):
+        """
+        Record that ``user`` granted ``scope`` to ``client``, adding to any
+        scope granted before.
+        """
+        consent, created = self.get_or_create(user=user, client=client,
+                                              defaults={'scope': scope})
+        if not created and not scopes.check(scope, consent.scope):
+            consent.scope |= scope
+            consent.save(update_fields=['scope', 'modified'])
+        return consent
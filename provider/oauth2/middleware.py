@@ -1,29 +1,52 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import re
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from django.http.response import HttpResponse
 from django.utils.functional import SimpleLazyObject
-from django.utils.timezone import now
 
-from provider.oauth2.models import AccessToken
+from provider import constants
+from provider.oauth2.principal import TokenUser
+from provider.oauth2.storage import get_token_storage
+from provider.oauth2.usage import token_used
 
 __author__ = 'amaru'
 
+FORM_CONTENT_TYPES = ('application/x-www-form-urlencoded', 'multipart/form-data')
+AUTHORIZATION_SCHEMES = ('token', 'bearer')
+
+
 class HttpResponseUnauthorized(HttpResponse):
     status_code = 401
 
 
-def _get_user(request):
+def _has_form_body(request):
+    """
+    Return ``True`` if the request body would be parsed into ``request.POST``.
+    """
+    if request.method != 'POST':
+        return False
+    content_type = request.META.get('CONTENT_TYPE', '')
+    return content_type.split(';', 1)[0].strip().lower() in FORM_CONTENT_TYPES
+
+
+def _get_access_token(request):
+    """
+    Extract the raw access token string from the request or return ``None``.
+    The ``Authorization`` header is read with the ``Bearer`` scheme of
+    :rfc:`6750#section-2.1` as well as the ``token`` scheme.
+    """
     oauth_token = None
     try:
         auth_header = request.META['HTTP_AUTHORIZATION']
-        if auth_header.startswith('token'):
-            try:
-                oauth_token = auth_header.split(' ')[1]
-            except IndexError:
-                return AnonymousUser()
+        scheme, _, credentials = auth_header.partition(' ')
+        if scheme.lower() in AUTHORIZATION_SCHEMES:
+            oauth_token = credentials.strip()
+            if not oauth_token:
+                return None
     except KeyError:
         pass
 
@@ -33,7 +56,7 @@ def _get_user(request):
         except KeyError:
             pass
 
-    if not oauth_token:
+    if not oauth_token and _has_form_body(request):
         try:
             oauth_token = request.POST['access_token']
         except KeyError:
@@ -45,20 +68,51 @@ def _get_user(request):
         except KeyError:
             pass
 
+    return oauth_token or None
+
+
+def _get_token(request):
+    oauth_token = _get_access_token(request)
+
     if not oauth_token:
-        return AnonymousUser()
+        return None
 
-    try:
-        token = AccessToken.objects.get(token=oauth_token, expires__gt=now(), user__is_active=True)
-    except AccessToken.DoesNotExist:
-        return AnonymousUser()
+    principal = get_token_storage().get_principal(oauth_token)
 
+    if principal is not None:
+        token_used(principal)
+
+    return principal
+
+
+def get_token(request):
+    """
+    Return the :class:`provider.oauth2.principal.TokenPrincipal` of the
+    access token presented with ``request`` or ``None``. The lookup happens
+    at most once per request.
+    """
+    if not hasattr(request, '_cached_oauth2_token'):
+        request._cached_oauth2_token = _get_token(request)
+    return request._cached_oauth2_token
+
+
+def _load_user(user_id):
     try:
-        return get_user_model().objects.get(pk=token.user_id)
+        return get_user_model().objects.get(pk=user_id)
     except get_user_model().DoesNotExist:
         return AnonymousUser()
 
 
+def _get_user(request):
+    token = get_token(request)
+
+    if token is None or token.user_id is None:
+        return AnonymousUser()
+
+    return TokenUser(token, _load_user,
+                     pk_attname=get_user_model()._meta.pk.attname)
+
+
 def get_user(request):
     if not hasattr(request, '_cached_user'):
         request._cached_user = _get_user(request)
@@ -76,9 +130,38 @@ class AuthenticationMiddleware(object):
     4. (Unsupported) Http params: "client_id=<ID>&client_secret=<SECRET>" // public requests where user isn't required
     5. Cookie: at=<OAUTH-TOKEN>
 
+    Both ``request.user`` and ``request.oauth2_token`` are lazy and share a
+    single token lookup. ``request.oauth2_token`` evaluates to a
+    :class:`provider.oauth2.principal.TokenPrincipal` or is falsy when no
+    valid token was presented.
+
+    Only paths matching :attr:`provider.constants.MIDDLEWARE_INCLUDE_PATHS`
+    and not matching :attr:`provider.constants.MIDDLEWARE_EXCLUDE_PATHS` are
+    inspected. Other requests keep whatever ``request.user`` is already set
+    (or get an :class:`AnonymousUser`) and never touch the token table.
+
     If a path requires an authenticated user, and none is presented, the method would return 401 access denied.
     """
 
+    def __init__(self):
+        self.include_paths = [re.compile(p) for p in constants.MIDDLEWARE_INCLUDE_PATHS]
+        self.exclude_paths = [re.compile(p) for p in constants.MIDDLEWARE_EXCLUDE_PATHS]
+
+    def is_token_path(self, path):
+        """
+        Return ``True`` if access tokens should be looked for on ``path``.
+        """
+        if self.include_paths and not any(p.match(path) for p in self.include_paths):
+            return False
+        return not any(p.match(path) for p in self.exclude_paths)
+
     def process_request(self, request):
+        if not self.is_token_path(request.path_info):
+            if not hasattr(request, 'user'):
+                request.user = AnonymousUser()
+            request.oauth2_token = None
+            return None
+
         request.user = SimpleLazyObject(lambda: get_user(request))
+        request.oauth2_token = SimpleLazyObject(lambda: get_token(request))
         return None
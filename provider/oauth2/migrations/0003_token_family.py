@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import provider.utils
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oauth2', '0002_consent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accesstoken',
+            name='family',
+            field=models.CharField(db_index=True, max_length=40, null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='refreshtoken',
+            name='family',
+            field=models.CharField(db_index=True, max_length=40, null=True, blank=True),
+        ),
+        migrations.AlterField(
+            model_name='refreshtoken',
+            name='token',
+            field=models.CharField(default=provider.utils.long_token, max_length=255, db_index=True),
+        ),
+    ]
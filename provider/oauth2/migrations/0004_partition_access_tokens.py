@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from provider.oauth2.partitions import partition_access_tokens
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oauth2', '0003_token_family'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_access_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import provider.utils
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oauth2', '0004_partition_access_tokens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CleanupWatermark',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(unique=True, max_length=64)),
+                ('value', models.DateTimeField(null=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='accesstoken',
+            name='expires',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='grant',
+            name='expires',
+            field=models.DateTimeField(default=provider.utils.get_code_expiry, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='refreshtoken',
+            name='expired',
+            field=models.BooleanField(default=False, db_index=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+INDEX_NAME = 'oauth2_accesstoken_live_token'
+
+# Backends supporting ``CREATE INDEX ... WHERE``
+PARTIAL_INDEX_VENDORS = ('postgresql', 'sqlite')
+
+
+def create_live_token_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor not in PARTIAL_INDEX_VENDORS:
+        return
+    qn = connection.ops.quote_name
+    schema_editor.execute(
+        'CREATE INDEX {} ON {} ({}, {}) WHERE NOT {}'.format(
+            qn(INDEX_NAME), qn('oauth2_accesstoken'), qn('token'),
+            qn('expires'), qn('is_deleted')))
+
+
+def drop_live_token_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor not in PARTIAL_INDEX_VENDORS:
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS {}'.format(
+        connection.ops.quote_name(INDEX_NAME)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oauth2', '0005_cleanup_watermark'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_live_token_index, drop_live_token_index),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import provider.utils
+
+INDEX_NAME = 'oauth2_accesstoken_token_idx'
+
+# Backends whose planner uses the partial index of 0006_live_token_index for
+# token lookups. SQLite can not match ``"is_deleted" = ?`` with a bound
+# parameter against the index condition and keeps the full index.
+PARTIAL_INDEX_VENDORS = ('postgresql',)
+
+
+def create_token_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor in PARTIAL_INDEX_VENDORS:
+        return
+    qn = connection.ops.quote_name
+    schema_editor.execute('CREATE INDEX {} ON {} ({})'.format(
+        qn(INDEX_NAME), qn('oauth2_accesstoken'), qn('token')))
+
+
+def drop_token_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor in PARTIAL_INDEX_VENDORS:
+        return
+    qn = connection.ops.quote_name
+    schema_editor.execute(schema_editor.sql_delete_index % {
+        'table': qn('oauth2_accesstoken'), 'name': qn(INDEX_NAME)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oauth2', '0007_access_token_last_used'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='accesstoken',
+            name='token',
+            field=models.CharField(default=provider.utils.long_token, max_length=255),
+        ),
+        migrations.RunPython(create_token_index, drop_token_index),
+    ]
@@ -11,6 +11,8 @@ import os
 from django.conf import settings
 from django.core.validators import RegexValidator
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
@@ -19,8 +21,8 @@ from .. import constants, scope
 from ..validators import validate_uris
 from ..utils import (
     now, short_token, long_token, get_code_expiry, get_token_expiry,
-    serialize_instance, deserialize_instance)
-from .managers import AccessTokenManager
+    serialize_instance, deserialize_instance, get_redirect_uri_matcher)
+from .managers import AccessTokenManager, ClientManager, ConsentManager
 
 AUTH_USER_MODEL = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
 
@@ -124,12 +126,21 @@ class Client(models.Model):
         default=constants.CONFIDENTIAL)
     scope = ScopeField(default=0)
 
+    objects = ClientManager()
+
     class Meta:
         app_label = 'oauth2'
 
     def __str__(self):
         return self.redirect_uri
 
+    @property
+    def redirect_uris(self):
+        """
+        :class:`provider.utils.RedirectURIMatcher` for :attr:`redirect_uri`.
+        """
+        return get_redirect_uri_matcher(self.redirect_uri or '')
+
     def get_default_token_expiry(self):
         public = (self.client_type == 1)
         return get_token_expiry(public)
@@ -190,7 +201,8 @@ class Grant(models.Model):
         max_length=255,
         default=long_token)
     expires = models.DateTimeField(
-        default=get_code_expiry)
+        default=get_code_expiry,
+        db_index=True)
     redirect_uri = models.CharField(
         max_length=255,
         blank=True)
@@ -223,6 +235,9 @@ class AccessToken(models.Model):
     * :attr:`expires` - :attr:`datetime.datetime`
     * :attr:`scope`
 
+    Tokens issued from the same grant share a :attr:`family` that is carried
+    over to the tokens issued when refreshing them.
+
     Expected methods:
 
     * :meth:`get_expire_delta` - returns an integer representing seconds to
@@ -233,23 +248,30 @@ class AccessToken(models.Model):
         null=True, blank=True)
     token = models.CharField(
         max_length=255,
-        default=long_token,
-        db_index=True)
+        default=long_token)
     client = models.ForeignKey(
         Client)
-    expires = models.DateTimeField()
+    expires = models.DateTimeField(
+        db_index=True)
     scope = ScopeField(
         default=0)
     type = models.IntegerField(
         default=0)
     is_deleted = models.BooleanField(
         default=False)
+    family = models.CharField(
+        max_length=40,
+        null=True, blank=True,
+        db_index=True)
+    last_used = models.DateTimeField(
+        null=True, blank=True)
     created = models.DateTimeField(
         auto_now_add=True)
     modified = models.DateTimeField(
         auto_now=True)
 
     objects = AccessTokenManager()
+    all_objects = models.Manager()
 
     class Meta:
         app_label = 'oauth2'
@@ -257,9 +279,20 @@ class AccessToken(models.Model):
     def __str__(self):
         return self.token
 
+    def soft_delete(self):
+        """
+        Revoke this token and its refresh token by flagging it as deleted.
+        The row is kept until the ``sweep_orphans`` management command
+        removes it.
+        """
+        self.is_deleted = True
+        self.save(update_fields=['is_deleted', 'modified'])
+
     def save(self, *args, **kwargs):
         if not self.expires:
             self.expires = self.client.get_default_token_expiry()
+        if not self.family and self.pk is None:
+            self.family = short_token()
         return super(AccessToken, self).save(*args, **kwargs)
 
     def get_expire_delta(self, reference=None):
@@ -295,20 +328,27 @@ class RefreshToken(models.Model):
     * :attr:`access_token` - :class:`AccessToken`
     * :attr:`client` - :class:`Client`
     * :attr:`expired` - ``boolean``
+    * :attr:`family` - the :attr:`AccessToken.family` it was issued in
     """
     user = models.ForeignKey(
         AUTH_USER_MODEL,
         blank=True, null=True)
     token = models.CharField(
         max_length=255,
-        default=long_token)
+        default=long_token,
+        db_index=True)
     access_token = models.OneToOneField(
         AccessToken,
         related_name='refresh_token')
     client = models.ForeignKey(
         Client)
     expired = models.BooleanField(
-        default=False)
+        default=False,
+        db_index=True)
+    family = models.CharField(
+        max_length=40,
+        null=True, blank=True,
+        db_index=True)
     created = models.DateTimeField(
         auto_now_add=True)
     modified = models.DateTimeField(
@@ -319,3 +359,73 @@ class RefreshToken(models.Model):
 
     def __str__(self):
         return self.token
+
+
+@python_2_unicode_compatible
+class Consent(models.Model):
+    """
+    The scope a resource owner granted to a client through the authorization
+    flow. There is at most one consent per user and client, which lets
+    :class:`provider.oauth2.views.Authorize` skip the authorization form
+    with a single unique index lookup.
+
+    Expected fields:
+
+    * :attr:`user`
+    * :attr:`client` - :class:`Client`
+    * :attr:`scope`
+    """
+    user = models.ForeignKey(
+        AUTH_USER_MODEL)
+    client = models.ForeignKey(
+        Client)
+    scope = ScopeField(
+        default=0)
+    created = models.DateTimeField(
+        auto_now_add=True)
+    modified = models.DateTimeField(
+        auto_now=True)
+
+    objects = ConsentManager()
+
+    class Meta:
+        app_label = 'oauth2'
+        unique_together = ('user', 'client')
+
+    def __str__(self):
+        return '{} - {}'.format(self.user_id, self.client_id)
+
+
+@python_2_unicode_compatible
+class CleanupWatermark(models.Model):
+    """
+    Bookkeeping for the ``clean_tokens`` management command: the ``expires``
+    up to which rows named by :attr:`name` have been removed.
+    """
+    name = models.CharField(
+        max_length=64,
+        unique=True)
+    value = models.DateTimeField(
+        null=True)
+    modified = models.DateTimeField(
+        auto_now=True)
+
+    class Meta:
+        app_label = 'oauth2'
+
+    def __str__(self):
+        return self.name
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+def forget_cached_client(sender, instance, **kwargs):
+    Client.objects.forget(instance.client_id)
+
+
+@receiver(post_save, sender=AccessToken)
+@receiver(post_delete, sender=AccessToken)
+def forget_cached_access_token(sender, instance, created=False, **kwargs):
+    AccessToken.objects.forget(instance.token)
+    if not created:
+        AccessToken.objects.forget_issued(instance)
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Monthly range partitioning of the access token table by ``expires``.
+
+On PostgreSQL 11 and later, with :attr:`provider.constants.PARTITION_TOKENS`
+enabled, migration ``0004_partition_access_tokens`` turns
+``oauth2_accesstoken`` into a partitioned table and the ``partition_tokens``
+management command keeps partitions ahead of the longest token lifetime.
+Months that lie entirely in the past are removed by dropping their
+partition instead of deleting rows one by one.
+
+Partitions are kept one month beyond the longest token lifetime so that
+tokens issued between two runs of the command find their partition. Rows
+that still end up in the ``DEFAULT`` partition, for instance tokens
+invalidated into a month whose partition was already dropped, are moved
+into a monthly partition when it is created, and deleted from ``DEFAULT``
+once their month lies in the past.
+
+PostgreSQL can not enforce foreign keys pointing at a partitioned table
+whose primary key does not include the partition column, so the constraint
+from ``oauth2_refreshtoken.access_token_id`` is dropped. Refresh tokens of a
+dropped partition are deleted with it, as the row by row delete cascades
+to them as well. The constraints from the token table to the user and
+client tables are recreated on the partitioned table.
+"""
+from __future__ import unicode_literals
+
+import re
+from datetime import date
+
+from .. import constants
+from ..utils import now
+
+TABLE = 'oauth2_accesstoken'
+REFRESH_TABLE = 'oauth2_refreshtoken'
+UNPARTITIONED_TABLE = TABLE + '_unpartitioned'
+DEFAULT_PARTITION = TABLE + '_default'
+INDEXED_COLUMNS = ('client_id', 'user_id', 'family')
+FOREIGN_KEYS = ('user', 'client')
+
+_partition_re = re.compile(r'^{}_p(\d{{4}})(\d{{2}})$'.format(TABLE))
+
+
+def supports_partitioning(connection):
+    """
+    Return ``True`` if ``connection`` can hold a partitioned token table.
+    """
+    return connection.vendor == 'postgresql' and connection.pg_version >= 110000
+
+
+def is_partitioned(cursor):
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table pt "
+        "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = %s", [TABLE])
+    return cursor.fetchone() is not None
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return '{}_p{:04d}{:02d}'.format(TABLE, month.year, month.month)
+
+
+def longest_lifetime():
+    """
+    Return the longest lifetime an access token can be issued for.
+    """
+    return max(constants.EXPIRE_DELTA, constants.EXPIRE_DELTA_PUBLIC)
+
+
+def last_needed_month(reference=None):
+    """
+    Return the last month a partition should exist for: one month past the
+    expiry of a token issued at ``reference`` with :func:`longest_lifetime`.
+    """
+    return add_months(month_start((reference or now()) + longest_lifetime()), 1)
+
+
+def has_default_partition(cursor):
+    cursor.execute("SELECT to_regclass(%s)", [DEFAULT_PARTITION])
+    return cursor.fetchone()[0] is not None
+
+
+def get_partitions(cursor):
+    """
+    Return the monthly partitions as a sorted list of ``(month, name)``.
+    """
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s", [TABLE])
+    partitions = []
+    for (name,) in cursor.fetchall():
+        match = _partition_re.match(name)
+        if match:
+            partitions.append(
+                (date(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(partitions)
+
+
+def create_partitions(connection, cursor, start, end):
+    """
+    Create the missing partitions for every month from ``start`` up to and
+    including ``end`` and return their names. Rows of a new month that
+    already went to the ``DEFAULT`` partition are moved into it, as
+    PostgreSQL refuses to create a partition overlapping rows in ``DEFAULT``.
+    """
+    qn = connection.ops.quote_name
+    existing = set(name for month, name in get_partitions(cursor))
+    with_default = has_default_partition(cursor)
+    created = []
+
+    month = month_start(start)
+    while month <= end:
+        name = partition_name(month)
+        if name not in existing:
+            bounds = [month, add_months(month, 1)]
+            misplaced = False
+            if with_default:
+                cursor.execute(
+                    'SELECT 1 FROM {} WHERE expires >= %s AND expires < %s '
+                    'LIMIT 1'.format(qn(DEFAULT_PARTITION)), bounds)
+                misplaced = cursor.fetchone() is not None
+            if misplaced:
+                cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(
+                    qn(TABLE), qn(DEFAULT_PARTITION)))
+            cursor.execute(
+                'CREATE TABLE {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)'.format(
+                    qn(name), qn(TABLE)), bounds)
+            if misplaced:
+                cursor.execute(
+                    'INSERT INTO {} SELECT * FROM {} '
+                    'WHERE expires >= %s AND expires < %s'.format(
+                        qn(name), qn(DEFAULT_PARTITION)), bounds)
+                cursor.execute(
+                    'DELETE FROM {} WHERE expires >= %s AND expires < %s'.format(
+                        qn(DEFAULT_PARTITION)), bounds)
+                cursor.execute('ALTER TABLE {} ATTACH PARTITION {} DEFAULT'.format(
+                    qn(TABLE), qn(DEFAULT_PARTITION)))
+            created.append(name)
+        month = add_months(month, 1)
+
+    return created
+
+
+def drop_expired_partitions(connection, cursor, reference=None):
+    """
+    Drop the partitions holding only tokens that expired before
+    ``reference`` and return their names.
+    """
+    qn = connection.ops.quote_name
+    today = (reference or now()).date()
+    dropped = []
+
+    for month, name in get_partitions(cursor):
+        if add_months(month, 1) > today:
+            break
+        cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(
+            qn(TABLE), qn(name)))
+        cursor.execute(
+            'DELETE FROM {} WHERE access_token_id IN (SELECT id FROM {})'.format(
+                qn(REFRESH_TABLE), qn(name)))
+        cursor.execute('DROP TABLE {}'.format(qn(name)))
+        dropped.append(name)
+
+    return dropped
+
+
+def clean_default_partition(connection, cursor, reference=None):
+    """
+    Delete the tokens in the ``DEFAULT`` partition that expired before the
+    current month of ``reference``, together with their refresh tokens, and
+    return their number. These belong to months whose partitions were
+    already dropped.
+    """
+    if not has_default_partition(cursor):
+        return 0
+
+    qn = connection.ops.quote_name
+    cutoff = month_start((reference or now()).date())
+    cursor.execute(
+        'DELETE FROM {} WHERE access_token_id IN '
+        '(SELECT id FROM {} WHERE expires < %s)'.format(
+            qn(REFRESH_TABLE), qn(DEFAULT_PARTITION)), [cutoff])
+    cursor.execute('DELETE FROM {} WHERE expires < %s'.format(
+        qn(DEFAULT_PARTITION)), [cutoff])
+    return cursor.rowcount
+
+
+def partition_access_tokens(apps, schema_editor):
+    """
+    Migration operation converting the access token table into a table
+    partitioned by month of ``expires``. Does nothing unless
+    :attr:`provider.constants.PARTITION_TOKENS` is set and the database
+    supports it.
+    """
+    connection = schema_editor.connection
+    if not constants.PARTITION_TOKENS or not supports_partitioning(connection):
+        return
+
+    qn = connection.ops.quote_name
+    model = apps.get_model('oauth2', 'AccessToken')
+
+    with connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            return
+
+        cursor.execute(
+            "SELECT conname FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND confrelid = %s::regclass",
+            [REFRESH_TABLE, TABLE])
+        for (name,) in cursor.fetchall():
+            cursor.execute('ALTER TABLE {} DROP CONSTRAINT {}'.format(
+                qn(REFRESH_TABLE), qn(name)))
+
+        cursor.execute('ALTER TABLE {} RENAME TO {}'.format(
+            qn(TABLE), qn(UNPARTITIONED_TABLE)))
+        cursor.execute(
+            'CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS) '
+            'PARTITION BY RANGE (expires)'.format(
+                qn(TABLE), qn(UNPARTITIONED_TABLE)))
+        cursor.execute('ALTER TABLE {} ADD PRIMARY KEY (id, expires)'.format(
+            qn(TABLE)))
+        for column in INDEXED_COLUMNS:
+            cursor.execute('CREATE INDEX {} ON {} ({})'.format(
+                qn('{}_{}_part_idx'.format(TABLE, column)), qn(TABLE), qn(column)))
+        for name in FOREIGN_KEYS:
+            field = model._meta.get_field(name)
+            related = field.rel.to._meta
+            cursor.execute(
+                'ALTER TABLE {} ADD CONSTRAINT {} FOREIGN KEY ({}) '
+                'REFERENCES {} ({}) DEFERRABLE INITIALLY DEFERRED'.format(
+                    qn(TABLE), qn('{}_{}_part_fk'.format(TABLE, field.column)),
+                    qn(field.column), qn(related.db_table),
+                    qn(related.get_field(field.rel.field_name).column)))
+
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')",
+                       [UNPARTITIONED_TABLE])
+        sequence = cursor.fetchone()[0]
+        if sequence:
+            cursor.execute('ALTER SEQUENCE {} OWNED BY {}.id'.format(
+                sequence, qn(TABLE)))
+
+        cursor.execute('SELECT min(expires) FROM {}'.format(
+            qn(UNPARTITIONED_TABLE)))
+        start = cursor.fetchone()[0] or now()
+        create_partitions(connection, cursor, min(start, now()),
+                          last_needed_month())
+        cursor.execute('CREATE TABLE {} PARTITION OF {} DEFAULT'.format(
+            qn(DEFAULT_PARTITION), qn(TABLE)))
+
+        cursor.execute('INSERT INTO {} SELECT * FROM {}'.format(
+            qn(TABLE), qn(UNPARTITIONED_TABLE)))
+        cursor.execute('DROP TABLE {}'.format(qn(UNPARTITIONED_TABLE)))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.utils.functional import SimpleLazyObject, empty
+
+from .. import scope as scopes
+
+
+class TokenPrincipal(object):
+    """
+    Compact, read-only view of a validated access token. This is what
+    :class:`provider.oauth2.middleware.AuthenticationMiddleware` attaches to
+    the request as ``request.oauth2_token`` so that resource views can check
+    scopes without querying :class:`provider.oauth2.models.AccessToken`
+    again.
+
+    * :attr:`token_id` - primary key of the access token
+    * :attr:`user_id` - primary key of the resource owner
+    * :attr:`client_id` - primary key of the :class:`Client`
+    * :attr:`scope` - the scope bit mask
+    * :attr:`expires` - :attr:`datetime.datetime`
+    """
+    __slots__ = ('token_id', 'user_id', 'client_id', 'scope', 'expires')
+
+    def __init__(self, token_id, user_id, client_id, scope, expires):
+        self.token_id = token_id
+        self.user_id = user_id
+        self.client_id = client_id
+        self.scope = scope
+        self.expires = expires
+
+    def __repr__(self):
+        return '<TokenPrincipal: user={} client={} scope={}>'.format(
+            self.user_id, self.client_id, self.scope)
+
+    def has_scope(self, wants):
+        """
+        Return ``True`` if every bit of the scope mask ``wants`` was granted
+        to this token.
+        """
+        return scopes.check(wants, self.scope)
+
+
+class TokenUser(SimpleLazyObject):
+    """
+    Lazy user authenticated by a :class:`TokenPrincipal`. :attr:`user_id`,
+    :attr:`pk`, :attr:`client_id` and :attr:`scope` are answered from the
+    principal; the user row is only fetched through ``load`` once any other
+    attribute is accessed. Until then the user counts as authenticated,
+    afterwards the loaded object decides.
+    """
+    def __init__(self, principal, load, pk_attname='id'):
+        super(TokenUser, self).__init__(lambda: load(principal.user_id))
+        self.__dict__['principal'] = principal
+        self.__dict__['user_id'] = principal.user_id
+        self.__dict__['client_id'] = principal.client_id
+        self.__dict__['scope'] = principal.scope
+        self.__dict__['pk'] = principal.user_id
+        self.__dict__[pk_attname] = principal.user_id
+
+    def is_authenticated(self):
+        if self._wrapped is empty:
+            return True
+        return self._wrapped.is_authenticated()
+
+    def is_anonymous(self):
+        if self._wrapped is empty:
+            return False
+        return self._wrapped.is_anonymous()
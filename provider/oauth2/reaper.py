@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Background thread removing expired grants and tokens from within the
+application process, for deployments without a scheduler to run the
+``clean_tokens`` management command.
+
+When :attr:`provider.constants.REAPER_INTERVAL` is set the reaper is
+started by the first request a process serves through Django's WSGI handler.
+Management commands, the test client and the master process of pre-forking
+servers never start it. Every serving process runs one, but only the
+process holding the lease in
+:attr:`provider.constants.REAPER_CACHE` deletes rows. Each run deletes
+batches of :attr:`provider.constants.REAPER_BATCH_SIZE` rows until nothing
+is left or :attr:`provider.constants.REAPER_BUDGET` seconds are used up.
+"""
+from __future__ import unicode_literals
+
+import logging
+import random
+import threading
+import time
+import uuid
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import close_old_connections
+
+from .. import constants
+from ..utils import now, get_cache
+from . import cleanup
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = 'oauth2:reaper'
+
+
+class Reaper(object):
+    """
+    Removes expired rows in small batches at jittered intervals.
+
+    :attr:`removed` counts the rows removed per category since the reaper
+    was created and :attr:`runs` how often it held the lease.
+    """
+    def __init__(self, interval, batch_size, budget, cache):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.budget = budget
+        self.cache = cache
+        self.id = uuid.uuid4().hex
+        self.removed = {}
+        self.runs = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def is_leader(self):
+        """
+        Take or renew the lease. It outlives two intervals so a leader that
+        stops running is replaced.
+        """
+        lease = int(self.interval * 2) + 1
+        if self.cache.add(LOCK_KEY, self.id, lease):
+            return True
+        if self.cache.get(LOCK_KEY) == self.id:
+            self.cache.set(LOCK_KEY, self.id, lease)
+            return True
+        return False
+
+    def run_once(self):
+        """
+        Remove expired rows if this reaper is the leader. Return the number
+        of rows removed per category, or ``None`` if another process holds
+        the lease.
+        """
+        if not self.is_leader():
+            return None
+
+        self.runs += 1
+        deadline = time.time() + self.budget
+        removed = {}
+
+        for name, queryset in cleanup.get_expired(now()):
+            count = cleanup.delete_in_batches(queryset, self.batch_size, deadline)
+            removed[name] = count
+            self.removed[name] = self.removed.get(name, 0) + count
+
+        logger.info('Removed expired rows: %s', ', '.join(
+            '{:d} {}'.format(count, name) for name, count in sorted(removed.items())))
+        return removed
+
+    def run(self):
+        while not self._stopped.wait(self.interval * random.uniform(0.5, 1.5)):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception('Removing expired rows failed')
+            finally:
+                close_old_connections()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='oauth2-reaper')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+
+_reaper = None
+_reaper_lock = threading.Lock()
+
+
+def start_reaper():
+    """
+    Start the reaper of this process once, if
+    :attr:`provider.constants.REAPER_INTERVAL` is set. Return it or ``None``.
+    """
+    global _reaper
+
+    if _reaper is not None or not constants.REAPER_INTERVAL:
+        return _reaper
+
+    with _reaper_lock:
+        if _reaper is None:
+            _reaper = Reaper(constants.REAPER_INTERVAL,
+                             constants.REAPER_BATCH_SIZE,
+                             constants.REAPER_BUDGET,
+                             get_cache(constants.REAPER_CACHE))
+            _reaper.start()
+    return _reaper
+
+
+def start_reaper_on_request(sender, **kwargs):
+    """
+    ``request_started`` receiver starting the reaper in processes serving
+    requests through :class:`django.core.handlers.wsgi.WSGIHandler`.
+    """
+    if issubclass(sender, WSGIHandler):
+        start_reaper()
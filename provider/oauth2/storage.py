@@ -0,0 +1,521 @@
+# -*- coding: utf-8 -*-
+"""
+Pluggable storage for OAuth2 grants and tokens. The backends in use are
+selected with :attr:`provider.constants.GRANT_STORAGE` and
+:attr:`provider.constants.TOKEN_STORAGE`.
+"""
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.module_loading import import_string
+
+from .. import constants
+from ..utils import now, get_cache, short_token
+from .models import Grant, AccessToken, RefreshToken
+from .principal import TokenPrincipal
+
+
+def _timeout(expires):
+    delta = expires - now()
+    return delta.days * 86400 + delta.seconds
+
+
+class BaseGrantStorage(object):
+    """
+    Stores authorization codes (:class:`provider.oauth2.models.Grant`)
+    between the authorization and the token request as outlined in
+    :rfc:`4.1.2`.
+    """
+    def save(self, grant):
+        """
+        Store ``grant``. Its ``user``, ``client``, ``code``, ``expires``,
+        ``redirect_uri`` and ``scope`` are set.
+        """
+        raise NotImplementedError
+
+    def get(self, code, client):
+        """
+        Return the live grant issued to ``client`` under ``code`` or ``None``.
+        """
+        raise NotImplementedError
+
+    def invalidate(self, grant):
+        """
+        Make sure ``grant`` can not be exchanged again.
+        """
+        raise NotImplementedError
+
+
+class DatabaseGrantStorage(BaseGrantStorage):
+    """
+    Default grant storage keeping grants in the ``Grant`` table.
+    """
+    def save(self, grant):
+        grant.save()
+
+    def get(self, code, client):
+        try:
+            return Grant.objects.get(code=code, client=client, expires__gt=now())
+        except Grant.DoesNotExist:
+            return None
+
+    def invalidate(self, grant):
+        if constants.DELETE_EXPIRED:
+            grant.delete()
+        else:
+            grant.expires = now() - timedelta(days=1)
+            grant.save()
+
+
+class CacheGrantStorage(BaseGrantStorage):
+    """
+    Grant storage keeping grants in the cache named by
+    :attr:`provider.constants.GRANT_CACHE` until they expire, without any
+    database writes.
+
+    :meth:`get` takes the grant out of the cache: the first caller to claim
+    a code through the cache's atomic ``add`` wins, so a code can only be
+    exchanged once even under concurrent requests. The returned grant is
+    never saved.
+    """
+    fields = ('code', 'user_id', 'client_id', 'scope', 'redirect_uri', 'expires')
+
+    @property
+    def cache(self):
+        return get_cache(constants.GRANT_CACHE)
+
+    def _key(self, code):
+        return 'oauth2:grant:{}'.format(code)
+
+    def save(self, grant):
+        timeout = _timeout(grant.expires)
+        if timeout <= 0:
+            return
+        self.cache.set(self._key(grant.code),
+                       dict((f, getattr(grant, f)) for f in self.fields),
+                       timeout)
+
+    def get(self, code, client):
+        cache = self.cache
+        key = self._key(code)
+
+        data = cache.get(key)
+        if data is None or data['client_id'] != client.pk or data['expires'] <= now():
+            return None
+
+        # claim the code, whoever adds the claim first may use it
+        if not cache.add(key + ':claimed', True, 60):
+            return None
+        cache.delete(key)
+
+        return Grant(**data)
+
+    def invalidate(self, grant):
+        self.cache.delete(self._key(grant.code))
+
+
+class BaseTokenStorage(object):
+    """
+    Stores access and refresh tokens for
+    :class:`provider.oauth2.views.AccessTokenView` and
+    :class:`provider.oauth2.middleware.AuthenticationMiddleware`.
+    """
+    def create_access_token(self, user, client, scope, family=None):
+        """
+        Issue and return a new access token. It starts a new token family
+        unless the ``family`` of a rotated refresh token is passed.
+        """
+        raise NotImplementedError
+
+    def create_refresh_token(self, user, client, access_token):
+        """
+        Issue and return a new refresh token bound to ``access_token`` and
+        its family.
+        """
+        raise NotImplementedError
+
+    def get_principal(self, token):
+        """
+        Return a :class:`provider.oauth2.principal.TokenPrincipal` for the
+        live access token ``token`` or ``None``.
+        """
+        raise NotImplementedError
+
+    def get_refresh_token(self, token, client):
+        """
+        Return the live refresh token issued to ``client`` under ``token``
+        or ``None``. Its ``access_token`` is the token it was last bound to.
+        """
+        raise NotImplementedError
+
+    def claim_refresh_token(self, refresh_token):
+        """
+        Take ``refresh_token`` out of circulation before it is rotated.
+        Return ``False`` if another request claimed it first.
+        """
+        raise NotImplementedError
+
+    def update_refresh_token(self, refresh_token, access_token):
+        """
+        Bind ``refresh_token`` to the new ``access_token`` it was rotated to.
+        Return ``False`` if it was rebound by another request in the
+        meantime.
+        """
+        raise NotImplementedError
+
+    def invalidate_access_token(self, access_token):
+        raise NotImplementedError
+
+    def invalidate_refresh_token(self, refresh_token):
+        raise NotImplementedError
+
+    def invalidate_family(self, family):
+        """
+        Invalidate every access and refresh token of ``family``.
+        """
+        raise NotImplementedError
+
+    def get_rotated_family(self, token, client):
+        """
+        Return the family of the refresh token ``token`` if it was issued to
+        ``client`` and has been used or invalidated already, else ``None``.
+        """
+        return None
+
+    def delete_expired(self):
+        """
+        Remove expired tokens and return how many were removed.
+        """
+        raise NotImplementedError
+
+
+class DatabaseTokenStorage(BaseTokenStorage):
+    """
+    Default token storage keeping tokens in the ``AccessToken`` and
+    ``RefreshToken`` tables.
+    """
+    def create_access_token(self, user, client, scope, family=None):
+        return AccessToken.objects.create(user=user, client=client, scope=scope,
+                                          family=family)
+
+    def create_refresh_token(self, user, client, access_token):
+        return RefreshToken.objects.create(user=user, client=client,
+                                           access_token=access_token,
+                                           family=access_token.family)
+
+    def get_principal(self, token):
+        return AccessToken.objects.get_principal(token)
+
+    def get_refresh_token(self, token, client):
+        try:
+            return RefreshToken.objects.select_related(
+                'access_token', 'user').get(token=token, expired=False,
+                                            client=client,
+                                            access_token__is_deleted=False)
+        except RefreshToken.DoesNotExist:
+            return None
+
+    def claim_refresh_token(self, refresh_token):
+        # UPDATE ... WHERE expired = false, only one concurrent caller matches
+        claimed = RefreshToken.objects.filter(
+            pk=refresh_token.pk, expired=False).update(expired=True,
+                                                       modified=now())
+        refresh_token.expired = True
+        if claimed and constants.DELETE_EXPIRED:
+            refresh_token.delete()
+        return claimed == 1
+
+    def update_refresh_token(self, refresh_token, access_token):
+        updated = RefreshToken.objects.filter(
+            pk=refresh_token.pk,
+            access_token=refresh_token.access_token_id).update(
+                access_token=access_token, modified=now())
+        refresh_token.access_token = access_token
+        return updated == 1
+
+    def invalidate_access_token(self, access_token):
+        if constants.DELETE_EXPIRED:
+            access_token.delete()
+        else:
+            access_token.expires = now() - timedelta(days=1)
+            access_token.save(update_fields=['expires', 'modified'])
+
+    def invalidate_refresh_token(self, refresh_token):
+        if constants.DELETE_EXPIRED:
+            refresh_token.delete()
+        else:
+            refresh_token.expired = True
+            refresh_token.save(update_fields=['expired', 'modified'])
+
+    def invalidate_family(self, family):
+        access_tokens = AccessToken.all_objects.filter(family=family)
+
+        # set based updates skip the signals that clear the token cache
+        if get_cache(constants.TOKEN_CACHE) is not None:
+            for token in access_tokens.values_list('token', flat=True):
+                AccessToken.objects.forget(token)
+
+        if constants.DELETE_EXPIRED:
+            RefreshToken.objects.filter(family=family).delete()
+            access_tokens.delete()
+        else:
+            RefreshToken.objects.filter(family=family, expired=False).update(
+                expired=True, modified=now())
+            access_tokens.filter(expires__gt=now()).update(
+                expires=now() - timedelta(days=1), modified=now())
+
+    def get_rotated_family(self, token, client):
+        return RefreshToken.objects.filter(
+            token=token, client=client, expired=True).values_list(
+            'family', flat=True).first()
+
+    def delete_expired(self):
+        count = RefreshToken.objects.filter(expired=True).count()
+        RefreshToken.objects.filter(expired=True).delete()
+        expired = AccessToken.all_objects.filter(expires__lt=now())
+        count += expired.count()
+        expired.delete()
+        return count
+
+
+class CacheTokenStorage(BaseTokenStorage):
+    """
+    Token storage keeping tokens in the cache named by
+    :attr:`provider.constants.TOKEN_STORAGE_CACHE`, without any database
+    writes. Access tokens expire from the cache with the token, refresh
+    tokens after :attr:`provider.constants.TOKEN_STORAGE_REFRESH_TIMEOUT`.
+
+    Tokens handed out by this storage are unsaved model instances with no
+    primary key. :attr:`provider.constants.SINGLE_ACCESS_TOKEN` and
+    :attr:`provider.constants.LIMIT_NUM_REFRESH_TOKEN` query the token
+    tables and have no effect on tokens kept here, and deactivating a user
+    does not revoke the user's tokens.
+    """
+    access_token_fields = ('token', 'user_id', 'client_id', 'scope', 'expires',
+                           'type', 'family')
+
+    @property
+    def cache(self):
+        return get_cache(constants.TOKEN_STORAGE_CACHE)
+
+    def _access_key(self, token):
+        return 'oauth2:at:{}'.format(token)
+
+    def _refresh_key(self, token):
+        return 'oauth2:rt:{}'.format(token)
+
+    def _family_key(self, family):
+        return 'oauth2:family:{}'.format(family)
+
+    def _is_invalidated(self, family):
+        return family is not None and self.cache.get(self._family_key(family))
+
+    def _save_access_token(self, access_token):
+        timeout = _timeout(access_token.expires)
+        if timeout > 0:
+            self.cache.set(self._access_key(access_token.token),
+                           dict((f, getattr(access_token, f))
+                                for f in self.access_token_fields),
+                           timeout)
+
+    def _save_refresh_token(self, refresh_token):
+        delta = constants.TOKEN_STORAGE_REFRESH_TIMEOUT
+        access_token = refresh_token.access_token
+        self.cache.set(self._refresh_key(refresh_token.token), {
+            'token': refresh_token.token,
+            'user_id': refresh_token.user_id,
+            'client_id': refresh_token.client_id,
+            'family': refresh_token.family,
+            'access_token': dict((f, getattr(access_token, f))
+                                 for f in self.access_token_fields),
+        }, delta.days * 86400 + delta.seconds)
+
+    def create_access_token(self, user, client, scope, family=None):
+        access_token = AccessToken(user=user, client=client, scope=scope,
+                                   expires=client.get_default_token_expiry(),
+                                   type=constants.CACHED_TOKEN,
+                                   family=family or short_token())
+        self._save_access_token(access_token)
+        return access_token
+
+    def create_refresh_token(self, user, client, access_token):
+        refresh_token = RefreshToken(user=user, client=client,
+                                     access_token=access_token,
+                                     family=access_token.family)
+        self._save_refresh_token(refresh_token)
+        return refresh_token
+
+    def get_principal(self, token):
+        data = self.cache.get(self._access_key(token))
+        if data is None or data['expires'] <= now() or data['user_id'] is None:
+            return None
+        if self._is_invalidated(data['family']):
+            return None
+        return TokenPrincipal(None, data['user_id'], data['client_id'],
+                              data['scope'], data['expires'])
+
+    def get_refresh_token(self, token, client):
+        data = self.cache.get(self._refresh_key(token))
+        if data is None or data['client_id'] != client.pk:
+            return None
+        if self._is_invalidated(data['family']):
+            return None
+        access = data['access_token']
+        access_token = AccessToken(token=access['token'],
+                                   user_id=access['user_id'], client=client,
+                                   scope=access['scope'],
+                                   expires=access['expires'],
+                                   type=access['type'],
+                                   family=access['family'])
+        return RefreshToken(token=data['token'], user_id=data['user_id'],
+                            client=client, access_token=access_token,
+                            family=data['family'])
+
+    def claim_refresh_token(self, refresh_token):
+        key = self._refresh_key(refresh_token.token)
+        if not self.cache.add(key + ':claimed', True, 60):
+            return False
+        self.cache.delete(key)
+        return True
+
+    def update_refresh_token(self, refresh_token, access_token):
+        refresh_token.access_token = access_token
+        self._save_refresh_token(refresh_token)
+        return True
+
+    def invalidate_access_token(self, access_token):
+        self.cache.delete(self._access_key(access_token.token))
+
+    def invalidate_refresh_token(self, refresh_token):
+        self.cache.delete(self._refresh_key(refresh_token.token))
+
+    def invalidate_family(self, family):
+        # tokens are not indexed by family, remember the family as revoked
+        # for as long as any of its tokens can live
+        delta = max(constants.TOKEN_STORAGE_REFRESH_TIMEOUT,
+                    constants.EXPIRE_DELTA, constants.EXPIRE_DELTA_PUBLIC)
+        self.cache.set(self._family_key(family), True,
+                       delta.days * 86400 + delta.seconds)
+
+    def delete_expired(self):
+        # entries expire on their own
+        return 0
+
+
+class TieredTokenStorage(BaseTokenStorage):
+    """
+    Token storage keeping access tokens issued for less than
+    :attr:`provider.constants.TOKEN_STORAGE_CACHE_THRESHOLD` in
+    :class:`CacheTokenStorage` and all others in
+    :class:`DatabaseTokenStorage`. Refresh tokens live in the tier of their
+    access token.
+
+    Cached access tokens carry :attr:`provider.constants.CACHED_TOKEN` in
+    ``type``. Database tokens are written through to
+    :attr:`provider.constants.TOKEN_CACHE` when it is configured, so lookups
+    of either tier are normally answered from a cache.
+    """
+    def __init__(self):
+        self.cache_storage = CacheTokenStorage()
+        self.database_storage = DatabaseTokenStorage()
+
+    def _is_short_lived(self, client):
+        lifetime = client.get_default_token_expiry() - now()
+        return lifetime < constants.TOKEN_STORAGE_CACHE_THRESHOLD
+
+    def _access_tier(self, access_token):
+        if access_token.type == constants.CACHED_TOKEN:
+            return self.cache_storage
+        return self.database_storage
+
+    def _refresh_tier(self, refresh_token):
+        if refresh_token.pk is None:
+            return self.cache_storage
+        return self.database_storage
+
+    def create_access_token(self, user, client, scope, family=None):
+        if self._is_short_lived(client):
+            return self.cache_storage.create_access_token(user, client, scope,
+                                                          family)
+        access_token = self.database_storage.create_access_token(
+            user, client, scope, family)
+        AccessToken.objects.remember(access_token)
+        return access_token
+
+    def create_refresh_token(self, user, client, access_token):
+        return self._access_tier(access_token).create_refresh_token(
+            user, client, access_token)
+
+    def get_principal(self, token):
+        return (self.cache_storage.get_principal(token) or
+                self.database_storage.get_principal(token))
+
+    def get_refresh_token(self, token, client):
+        return (self.cache_storage.get_refresh_token(token, client) or
+                self.database_storage.get_refresh_token(token, client))
+
+    def claim_refresh_token(self, refresh_token):
+        return self._refresh_tier(refresh_token).claim_refresh_token(refresh_token)
+
+    def update_refresh_token(self, refresh_token, access_token):
+        return self._refresh_tier(refresh_token).update_refresh_token(
+            refresh_token, access_token)
+
+    def invalidate_access_token(self, access_token):
+        self._access_tier(access_token).invalidate_access_token(access_token)
+
+    def invalidate_refresh_token(self, refresh_token):
+        self._refresh_tier(refresh_token).invalidate_refresh_token(refresh_token)
+
+    def invalidate_family(self, family):
+        self.cache_storage.invalidate_family(family)
+        self.database_storage.invalidate_family(family)
+
+    def get_rotated_family(self, token, client):
+        return self.database_storage.get_rotated_family(token, client)
+
+    def delete_expired(self):
+        return self.database_storage.delete_expired()
+
+
+_local_cache = LocMemCache('provider.oauth2.storage', {})
+
+
+class LocalTokenStorage(CacheTokenStorage):
+    """
+    :class:`CacheTokenStorage` keeping tokens in a process local in-memory
+    cache. Tokens are not shared between processes, which makes this storage
+    useful for tests and single process deployments only.
+    """
+    @property
+    def cache(self):
+        return _local_cache
+
+
+_storages = {}
+
+
+def _get_storage(path):
+    try:
+        return _storages[path]
+    except KeyError:
+        storage = _storages[path] = import_string(path)()
+        return storage
+
+
+def get_grant_storage():
+    """
+    Return the grant storage configured in
+    :attr:`provider.constants.GRANT_STORAGE`.
+    """
+    return _get_storage(constants.GRANT_STORAGE)
+
+
+def get_token_storage():
+    """
+    Return the token storage configured in
+    :attr:`provider.constants.TOKEN_STORAGE`.
+    """
+    return _get_storage(constants.TOKEN_STORAGE)
@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 
 import json
 import datetime
+from StringIO import StringIO
 from mock import patch
 
 try:
@@ -11,19 +12,35 @@ except ImportError:
     from urllib import parse as urlparse
 
 from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
 from django.http import QueryDict
-from django.test import TestCase
+from django.test import TestCase, RequestFactory
 from django.utils.html import escape
+from django.views.generic import View
 
-from .. import constants, scope
+from .. import constants, scope, throttling
 from ..compat import skipIfCustomUser, get_user_model
 from ..templatetags.scope import scopes
 from ..views import OAuthError
 from ..utils import now as date_now
-from .forms import ClientForm
-from .models import Client, Grant, AccessToken, RefreshToken
+from .forms import ClientForm, EmailAndPasswordGrantForm
+from .models import (
+    Client, Grant, AccessToken, RefreshToken, Consent, CleanupWatermark)
 from .backends import BasicClientBackend, RequestParamsClientBackend, AccessTokenBackend
+from .decorators import require_scope, ScopeRequiredMixin
+from .middleware import AuthenticationMiddleware
+from . import views
+from .managers import token_cache_key
+from .storage import get_token_storage
+from . import partitions
+from .reaper import Reaper, start_reaper_on_request
+from . import usage
+from .usage import UsageBuffer, get_usage_buffer
 
 
 @skipIfCustomUser
@@ -160,6 +177,19 @@ class AuthorizationTest(BaseOAuth2TestCase):
 
         self.assertEqual(200, response.status_code)
 
+    def test_authorization_prefix_redirect_uri(self):
+        client = self.get_client()
+        client.redirect_uri = 'http://example.com/application/1/ http://example.com/callbacks/*'
+        client.save()
+        self.login()
+
+        for redirect_uri, status in (('http://example.com/callbacks/a/', 200),
+                                     ('http://example.com/callbacks.evil.com/', 400)):
+            self.client.get(self.auth_url() + '?client_id={}&response_type=code&redirect_uri={}'.format(
+                client.client_id, redirect_uri))
+            response = self.client.get(self.auth_url2())
+            self.assertEqual(status, response.status_code)
+
     def test_authorization_requires_a_valid_scope(self):
         self.login()
 
@@ -202,6 +232,26 @@ class AuthorizationTest(BaseOAuth2TestCase):
         self.assertFalse('error' in response['Location'])
         self.assertTrue('code' in response['Location'])
 
+    def test_authorization_is_remembered(self):
+        client = self.get_client()
+        client.scope = constants.READ_WRITE
+        client.save()
+        self.login()
+
+        self._login_and_authorize()
+
+        consent = Consent.objects.get(user=self.get_user(), client=self.get_client())
+        self.assertEqual(constants.SCOPES[0][0], consent.scope)
+
+        AccessToken.objects.all().delete()
+
+        self.client.get(self.auth_url() + '?client_id={}&response_type=code&scope={}'.format(
+            self.get_client().client_id, constants.SCOPES[0][1]))
+        response = self.client.get(self.auth_url2())
+
+        self.assertEqual(302, response.status_code)
+        self.assertTrue(self.redirect_url() in response['Location'])
+
     def test_preserving_the_state_variable(self):
         self.login()
 
@@ -214,12 +264,73 @@ class AuthorizationTest(BaseOAuth2TestCase):
         self.assertTrue('code' in response['Location'])
         self.assertTrue('state=abc' in response['Location'])
 
+    def test_client_is_referenced_by_id(self):
+        self.login()
+        self._login_and_authorize()
+
+        self.assertEqual(self.get_client().client_id,
+            self.client.session['{}:client'.format(constants.SESSION_KEY)])
+
+    def test_client_cache(self):
+        self._client_cache = constants.CLIENT_CACHE
+        constants.CLIENT_CACHE = 'default'
+        client = self.get_client()
+
+        try:
+            self.assertEqual(client.pk, Client.objects.get_by_client_id(client.client_id).pk)
+            with self.assertNumQueries(0):
+                Client.objects.get_by_client_id(client.client_id)
+
+            client.redirect_uri = 'http://example.com/changed/'
+            client.save()
+
+            self.assertEqual('http://example.com/changed/',
+                Client.objects.get_by_client_id(client.client_id).redirect_uri)
+        finally:
+            constants.CLIENT_CACHE = self._client_cache
+
     def test_redirect_requires_valid_data(self):
         self.login()
         response = self.client.get(self.redirect_url())
         self.assertEqual(400, response.status_code)
 
 
+class SessionlessAuthorizationTest(BaseOAuth2TestCase):
+    fixtures = ['test_oauth2']
+
+    def setUp(self):
+        self._sessionless = constants.SESSIONLESS_AUTHORIZATION
+        constants.SESSIONLESS_AUTHORIZATION = True
+
+    def tearDown(self):
+        constants.SESSIONLESS_AUTHORIZATION = self._sessionless
+
+    def test_authorization_without_session_writes(self):
+        self.login()
+        session_data = dict(self.client.session.items())
+
+        self._login_and_authorize()
+
+        self.assertTrue(self.client.cookies[constants.STATE_COOKIE_NAME].value)
+
+        response = self.client.get(self.redirect_url())
+
+        self.assertEqual(302, response.status_code)
+        self.assertTrue('code' in response['Location'])
+        self.assertTrue('state=abc' in response['Location'])
+        self.assertEqual(session_data, dict(self.client.session.items()))
+        self.assertEqual('', self.client.cookies[constants.STATE_COOKIE_NAME].value)
+
+    def test_tampered_state_is_rejected(self):
+        self.login()
+        self._login_and_authorize()
+
+        self.client.cookies[constants.STATE_COOKIE_NAME] = 'tampered'
+        response = self.client.get(self.redirect_url())
+
+        self.assertEqual(400, response.status_code)
+
+
 class ValidationAndExceptionTest(BaseOAuth2TestCase):
     fixtures = ['test_oauth2.json']
 
@@ -418,6 +529,92 @@ class AccessTokenTest(BaseOAuth2TestCase):
         self.assertEqual('invalid_grant', json.loads(response.content)['error'],
             response.content)
 
+    def test_refreshing_a_soft_deleted_access_token(self):
+        token = self._login_authorize_get_token()
+        AccessToken.objects.get(token=token['access_token']).soft_delete()
+
+        response = self.client.post(self.access_token_url(), {
+            'grant_type': 'refresh_token',
+            'refresh_token': token['refresh_token'],
+            'client_id': self.get_client().client_id,
+            'client_secret': self.get_client().client_secret,
+        })
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual('invalid_grant', json.loads(response.content)['error'],
+            response.content)
+
+    def test_concurrent_refresh_is_rejected(self):
+        token = self._login_authorize_get_token()
+        stale = RefreshToken.objects.get(token=token['refresh_token'])
+
+        response = self.client.post(self.access_token_url(), {
+            'grant_type': 'refresh_token',
+            'refresh_token': token['refresh_token'],
+            'client_id': self.get_client().client_id,
+            'client_secret': self.get_client().client_secret,
+        })
+        self.assertEqual(200, response.status_code, response.content)
+        count = AccessToken.objects.count()
+
+        # a request that read the refresh token before it was rotated
+        with patch.object(views.AccessTokenView, 'get_refresh_token_grant',
+                          return_value=stale):
+            response = self.client.post(self.access_token_url(), {
+                'grant_type': 'refresh_token',
+                'refresh_token': token['refresh_token'],
+                'client_id': self.get_client().client_id,
+                'client_secret': self.get_client().client_secret,
+            })
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual('invalid_grant', json.loads(response.content)['error'])
+        self.assertEqual(count, AccessToken.objects.count())
+
+    def test_concurrent_refresh_is_rejected_keeping_refresh_token(self):
+        constants.KEEP_REFRESH_TOKEN = True
+        try:
+            self.test_concurrent_refresh_is_rejected()
+        finally:
+            constants.KEEP_REFRESH_TOKEN = False
+
+    def _refresh(self, refresh_token):
+        return self.client.post(self.access_token_url(), {
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh_token,
+            'client_id': self.get_client().client_id,
+            'client_secret': self.get_client().client_secret,
+        })
+
+    def test_refresh_keeps_token_family(self):
+        token = self._login_authorize_get_token()
+        family = AccessToken.objects.get(token=token['access_token']).family
+        self.assertTrue(family)
+
+        refreshed = json.loads(self._refresh(token['refresh_token']).content)
+
+        at = AccessToken.objects.get(token=refreshed['access_token'])
+        self.assertEqual(family, at.family)
+        self.assertEqual(family, at.refresh_token.family)
+        self.assertEqual(2, RefreshToken.objects.filter(family=family).count())
+
+    def test_refresh_token_reuse_revokes_family(self):
+        constants.REVOKE_FAMILY_ON_REUSE = True
+        try:
+            token = self._login_authorize_get_token()
+            refreshed = json.loads(self._refresh(token['refresh_token']).content)
+
+            response = self._refresh(token['refresh_token'])
+            self.assertEqual(400, response.status_code)
+            self.assertEqual('invalid_grant', json.loads(response.content)['error'])
+
+            self.assertFalse(AccessToken.objects.filter(
+                token=refreshed['access_token'], expires__gt=date_now()).exists())
+            response = self._refresh(refreshed['refresh_token'])
+            self.assertEqual(400, response.status_code)
+        finally:
+            constants.REVOKE_FAMILY_ON_REUSE = False
+
     def test_password_grant_public(self):
         c = self.get_client()
         c.client_type = constants.PUBLIC
@@ -437,6 +634,62 @@ class AccessTokenTest(BaseOAuth2TestCase):
         expires_in_days = round(expires_in / (60.0 * 60.0 * 24.0))
         self.assertEqual(expires_in_days, constants.EXPIRE_DELTA_PUBLIC.days)
 
+    def test_password_grant_overloaded(self):
+        self._hash_config = (constants.PASSWORD_HASH_CONCURRENCY,
+                             constants.PASSWORD_HASH_QUEUE_DEPTH)
+        constants.PASSWORD_HASH_CONCURRENCY = 1
+        constants.PASSWORD_HASH_QUEUE_DEPTH = 0
+        limiter = throttling.get_password_limiter()
+
+        data = {
+            'grant_type': 'password',
+            'client_id': self.get_client().client_id,
+            'client_secret': self.get_client().client_secret,
+            'username': self.get_user().username,
+            'password': self.get_password(),
+        }
+
+        try:
+            with limiter:
+                response = self.client.post(self.access_token_url(), data)
+            self.assertEqual(503, response.status_code, response.content)
+            self.assertEqual('temporarily_unavailable',
+                json.loads(response.content)['error'])
+
+            response = self.client.post(self.access_token_url(), data)
+            self.assertEqual(200, response.status_code, response.content)
+        finally:
+            (constants.PASSWORD_HASH_CONCURRENCY,
+             constants.PASSWORD_HASH_QUEUE_DEPTH) = self._hash_config
+
+    def test_password_grant_sheds_repeated_failures(self):
+        self._limit = constants.LOGIN_FAILURE_LIMIT_USERNAME
+        constants.LOGIN_FAILURE_LIMIT_USERNAME = 2
+        throttling.get_throttling_cache().clear()
+
+        data = {
+            'grant_type': 'password',
+            'client_id': self.get_client().client_id,
+            'client_secret': self.get_client().client_secret,
+            'username': self.get_user().username,
+            'password': 'wrong',
+        }
+
+        try:
+            for i in range(2):
+                response = self.client.post(self.access_token_url(), data)
+                self.assertEqual(400, response.status_code, response.content)
+
+            data['password'] = self.get_password()
+            with patch('provider.oauth2.forms.authenticate') as authenticate:
+                response = self.client.post(self.access_token_url(), data)
+                self.assertFalse(authenticate.called)
+            self.assertEqual(429, response.status_code, response.content)
+            self.assertTrue(response.has_header('Retry-After'))
+        finally:
+            constants.LOGIN_FAILURE_LIMIT_USERNAME = self._limit
+            throttling.get_throttling_cache().clear()
+
     def test_password_grant_confidential(self):
         c = self.get_client()
         c.client_type = constants.CONFIDENTIAL
@@ -469,6 +722,27 @@ class AccessTokenTest(BaseOAuth2TestCase):
         self.assertEqual(200, response.status_code, response.content)
         self.assertTrue(json.loads(response.content)['refresh_token'])
 
+    def test_email_and_password_grant_fetches_user_once(self):
+        user = self.get_user()
+        # avoid the extra query of a password hash upgrade
+        user.set_password(self.get_password())
+        user.save()
+        form = EmailAndPasswordGrantForm({
+            'email': user.email,
+            'password': self.get_password(),
+        }, client=self.get_client())
+
+        with self.assertNumQueries(1):
+            self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(user.pk, form.cleaned_data['user'].pk)
+
+        form = EmailAndPasswordGrantForm({
+            'email': user.email,
+            'password': 'wrong',
+        }, client=self.get_client())
+        self.assertFalse(form.is_valid())
+        self.assertEqual('invalid_grant', form.errors['error'])
+
     def test_password_grant_confidential_no_secret(self):
         c = self.get_client()
         c.client_type = constants.CONFIDENTIAL
@@ -551,6 +825,61 @@ class AccessTokenTest(BaseOAuth2TestCase):
         # No refresh token should be made for client_credentials grants
         self.assertEqual(0, RefreshToken.objects.filter(access_token__token=data['access_token']).count())
 
+    def test_client_credentials_grant__rate_limited(self):
+        self._limits = constants.CLIENT_RATE_LIMITS
+        constants.CLIENT_RATE_LIMITS = {'confidential': (0.01, 2)}
+        throttling.get_throttling_cache().clear()
+        c = self.get_client()
+        data = {
+            'grant_type': 'client_credentials',
+            'client_id': c.client_id,
+            'client_secret': c.client_secret,
+        }
+
+        try:
+            for i in range(2):
+                response = self.client.post(self.access_token_url(), data)
+                self.assertEqual(200, response.status_code, response.content)
+
+            tokens = AccessToken.objects.count()
+            response = self.client.post(self.access_token_url(), data)
+            self.assertEqual(429, response.status_code, response.content)
+            self.assertEqual('temporarily_unavailable',
+                json.loads(response.content)['error'])
+            self.assertTrue(int(response['Retry-After']) > 0)
+            self.assertEqual(tokens, AccessToken.objects.count())
+        finally:
+            constants.CLIENT_RATE_LIMITS = self._limits
+            throttling.get_throttling_cache().clear()
+
+    def test_client_credentials_grant__reuses_issued_token(self):
+        self._issued_cache = constants.ISSUED_TOKEN_CACHE
+        constants.ISSUED_TOKEN_CACHE = 'default'
+        c = self.get_client()
+        data = {
+            'grant_type': 'client_credentials',
+            'client_id': c.client_id,
+            'client_secret': c.client_secret,
+        }
+
+        try:
+            response = self.client.post(self.access_token_url(), data)
+            self.assertEqual(200, response.status_code, response.content)
+            token = json.loads(response.content)['access_token']
+            tokens = AccessToken.objects.count()
+
+            response = self.client.post(self.access_token_url(), data)
+            self.assertEqual(200, response.status_code, response.content)
+            self.assertEqual(token, json.loads(response.content)['access_token'])
+            self.assertEqual(tokens, AccessToken.objects.count())
+
+            AccessToken.objects.get(token=token).delete()
+
+            response = self.client.post(self.access_token_url(), data)
+            self.assertNotEqual(token, json.loads(response.content)['access_token'])
+        finally:
+            constants.ISSUED_TOKEN_CACHE = self._issued_cache
+
     def test_client_credentials_grant__no_user(self):
         c = self.get_client(id=4) # client.user = None
         c.client_type = constants.CONFIDENTIAL
@@ -713,6 +1042,161 @@ class AccessTokenTest(BaseOAuth2TestCase):
         constants.KEEP_REFRESH_TOKEN = False
 
 
+class CacheGrantStorageTest(BaseOAuth2TestCase):
+    fixtures = ['test_oauth2']
+
+    def setUp(self):
+        self._grant_storage = constants.GRANT_STORAGE
+        constants.GRANT_STORAGE = 'provider.oauth2.storage.CacheGrantStorage'
+
+    def tearDown(self):
+        constants.GRANT_STORAGE = self._grant_storage
+
+    def test_grant_is_taken_once(self):
+        self.login()
+        self._login_and_authorize()
+
+        response = self.client.get(self.redirect_url())
+        code = urlparse.parse_qs(urlparse.urlparse(response['Location']).query)['code'][0]
+        self.assertFalse(Grant.objects.exists())
+
+        data = {
+            'grant_type': 'authorization_code',
+            'client_id': self.get_client().client_id,
+            'client_secret': self.get_client().client_secret,
+            'code': code}
+
+        response = self.client.post(self.access_token_url(), data)
+        self.assertEqual(200, response.status_code, response.content)
+        token = AccessToken.objects.get(token=json.loads(response.content)['access_token'])
+        self.assertEqual(self.get_user(), token.user)
+
+        response = self.client.post(self.access_token_url(), data)
+        self.assertEqual(400, response.status_code)
+        self.assertEqual('invalid_grant', json.loads(response.content)['error'])
+
+
+class CacheTokenStorageTest(BaseOAuth2TestCase):
+    fixtures = ['test_oauth2']
+
+    def setUp(self):
+        self._token_storage = constants.TOKEN_STORAGE
+        constants.TOKEN_STORAGE = 'provider.oauth2.storage.LocalTokenStorage'
+        client = self.get_client()
+        client.scope = constants.READ_WRITE
+        client.save()
+
+    def tearDown(self):
+        constants.TOKEN_STORAGE = self._token_storage
+
+    def _password_grant(self):
+        c = self.get_client()
+        return self.client.post(self.access_token_url(), {
+            'grant_type': 'password',
+            'client_id': c.client_id,
+            'client_secret': c.client_secret,
+            'username': self.get_user().username,
+            'password': self.get_password(),
+            'scope': 'read'})
+
+    def _refresh(self, refresh_token):
+        c = self.get_client()
+        return self.client.post(self.access_token_url(), {
+            'grant_type': 'refresh_token',
+            'client_id': c.client_id,
+            'client_secret': c.client_secret,
+            'refresh_token': refresh_token})
+
+    def _client_credentials(self):
+        c = self.get_client()
+        c.client_type = constants.CONFIDENTIAL
+        c.save()
+        return self.client.post(self.access_token_url(), {
+            'grant_type': 'client_credentials',
+            'client_id': c.client_id,
+            'client_secret': c.client_secret})
+
+    def _request(self, token):
+        request = RequestFactory().get('/api/')
+        request.META['HTTP_AUTHORIZATION'] = 'token {}'.format(token)
+        AuthenticationMiddleware().process_request(request)
+        return request
+
+    def _principal(self, token):
+        return self._request(token).oauth2_token
+
+    def test_client_credentials_token_is_anonymous(self):
+        response = self._client_credentials()
+        self.assertEqual(200, response.status_code, response.content)
+        request = self._request(json.loads(response.content)['access_token'])
+
+        self.assertFalse(request.oauth2_token)
+        self.assertFalse(request.user.is_authenticated())
+
+    def test_tokens_are_not_written_to_the_database(self):
+        response = self._password_grant()
+        self.assertEqual(200, response.status_code, response.content)
+        token = json.loads(response.content)
+
+        self.assertFalse(AccessToken.objects.exists())
+        self.assertFalse(RefreshToken.objects.exists())
+
+        principal = self._principal(token['access_token'])
+        self.assertEqual(self.get_user().pk, principal.user_id)
+        self.assertEqual(constants.READ, principal.scope)
+
+    def test_refresh_token_rotation(self):
+        token = json.loads(self._password_grant().content)
+
+        response = self._refresh(token['refresh_token'])
+        self.assertEqual(200, response.status_code, response.content)
+        refreshed = json.loads(response.content)
+
+        self.assertFalse(self._principal(token['access_token']))
+        self.assertTrue(self._principal(refreshed['access_token']))
+
+        response = self._refresh(token['refresh_token'])
+        self.assertEqual(400, response.status_code)
+        self.assertEqual('invalid_grant', json.loads(response.content)['error'])
+
+    def test_invalidate_family(self):
+        token = json.loads(self._password_grant().content)
+        refreshed = json.loads(self._refresh(token['refresh_token']).content)
+
+        storage = get_token_storage()
+        family = storage.get_refresh_token(refreshed['refresh_token'],
+                                           self.get_client()).family
+        storage.invalidate_family(family)
+
+        self.assertFalse(self._principal(refreshed['access_token']))
+        self.assertEqual(400, self._refresh(refreshed['refresh_token']).status_code)
+
+
+class TieredTokenStorageTest(CacheTokenStorageTest):
+    def setUp(self):
+        super(TieredTokenStorageTest, self).setUp()
+        self._threshold = constants.TOKEN_STORAGE_CACHE_THRESHOLD
+        constants.TOKEN_STORAGE = 'provider.oauth2.storage.TieredTokenStorage'
+        constants.TOKEN_STORAGE_CACHE_THRESHOLD = datetime.timedelta(days=400)
+
+    def tearDown(self):
+        constants.TOKEN_STORAGE_CACHE_THRESHOLD = self._threshold
+        super(TieredTokenStorageTest, self).tearDown()
+
+    def test_long_lived_tokens_are_written_to_the_database(self):
+        constants.TOKEN_STORAGE_CACHE_THRESHOLD = datetime.timedelta(days=1)
+
+        token = json.loads(self._password_grant().content)
+        at = AccessToken.objects.get(token=token['access_token'])
+        self.assertEqual(constants.DATABASE_TOKEN, at.type)
+        self.assertTrue(RefreshToken.objects.filter(access_token=at).exists())
+        self.assertEqual(at.pk, self._principal(token['access_token']).token_id)
+
+        response = self._refresh(token['refresh_token'])
+        self.assertEqual(200, response.status_code, response.content)
+        self.assertFalse(self._principal(token['access_token']))
+
+
 class AuthBackendTest(BaseOAuth2TestCase):
     fixtures = ['test_oauth2']
 
@@ -745,6 +1229,221 @@ class AuthBackendTest(BaseOAuth2TestCase):
         self.assertIsNotNone(authenticated)
 
 
+class AuthenticationMiddlewareTest(BaseOAuth2TestCase):
+    fixtures = ['test_oauth2']
+
+    def _request(self, token=None, path='/api/'):
+        request = RequestFactory().get(path)
+        if token is not None:
+            request.META['HTTP_AUTHORIZATION'] = 'token {}'.format(token)
+        AuthenticationMiddleware().process_request(request)
+        return request
+
+    def test_anonymous_request(self):
+        request = self._request()
+        self.assertFalse(request.user.is_authenticated())
+        self.assertFalse(request.oauth2_token)
+
+    def test_client_credentials_token_is_anonymous(self):
+        c = self.get_client()
+        c.client_type = constants.CONFIDENTIAL
+        c.save()
+        response = self.client.post(self.access_token_url(), {
+            'grant_type': 'client_credentials',
+            'client_id': c.client_id,
+            'client_secret': c.client_secret})
+        self.assertEqual(200, response.status_code, response.content)
+        request = self._request(json.loads(response.content)['access_token'])
+
+        self.assertFalse(request.oauth2_token)
+        self.assertFalse(request.user.is_authenticated())
+
+    def test_token_principal(self):
+        token = AccessToken.objects.create(user=self.get_user(),
+            client=self.get_client(), scope=constants.READ)
+        request = self._request(token.token)
+
+        self.assertEqual(token.pk, request.oauth2_token.token_id)
+        self.assertEqual(token.user_id, request.oauth2_token.user_id)
+        self.assertEqual(token.client_id, request.oauth2_token.client_id)
+        self.assertEqual(constants.READ, request.oauth2_token.scope)
+        self.assertEqual(self.get_user().pk, request.user.pk)
+
+    def test_user_is_loaded_lazily(self):
+        token = AccessToken.objects.create(user=self.get_user(),
+            client=self.get_client(), scope=constants.READ)
+        request = self._request(token.token)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(request.user.is_authenticated())
+            self.assertEqual(token.user_id, request.user.user_id)
+            self.assertEqual(token.user_id, request.user.pk)
+            self.assertEqual(token.client_id, request.user.client_id)
+
+        username = self.get_user().username
+        with self.assertNumQueries(1):
+            self.assertEqual(username, request.user.username)
+
+    def test_soft_deleted_token(self):
+        token = AccessToken.objects.create(user=self.get_user(),
+            client=self.get_client(), scope=constants.READ)
+        self.assertTrue(self._request(token.token).oauth2_token)
+
+        token.soft_delete()
+
+        self.assertFalse(self._request(token.token).oauth2_token)
+        self.assertFalse(AccessToken.objects.filter(pk=token.pk).exists())
+        self.assertTrue(AccessToken.all_objects.filter(pk=token.pk).exists())
+        self.assertIsNone(AccessTokenBackend().authenticate(
+            access_token=token.token, client=self.get_client()))
+
+    def test_last_used_is_tracked(self):
+        token = AccessToken.objects.create(user=self.get_user(),
+            client=self.get_client(), scope=constants.READ)
+        constants.TRACK_LAST_USED = True
+        try:
+            self.assertTrue(self._request(token.token).oauth2_token)
+        finally:
+            constants.TRACK_LAST_USED = False
+
+        self.assertIsNone(AccessToken.objects.get(pk=token.pk).last_used)
+        get_usage_buffer().flush()
+        self.assertIsNotNone(AccessToken.objects.get(pk=token.pk).last_used)
+
+    def test_missing_user_is_anonymous(self):
+        token = AccessToken.objects.create(user=self.get_user(),
+            client=self.get_client(), scope=constants.READ)
+        request = self._request(token.token)
+        self.assertEqual(token.user_id, request.user.pk)
+        get_user_model().objects.filter(pk=token.user_id).delete()
+
+        self.assertTrue(request.user.is_authenticated())
+        self.assertEqual('', request.user.username)
+        self.assertFalse(request.user.is_authenticated())
+        self.assertTrue(request.user.is_anonymous())
+
+    def test_path_scoping(self):
+        token = AccessToken.objects.create(user=self.get_user(),
+            client=self.get_client(), scope=constants.READ)
+        self._include = constants.MIDDLEWARE_INCLUDE_PATHS
+        self._exclude = constants.MIDDLEWARE_EXCLUDE_PATHS
+        constants.MIDDLEWARE_INCLUDE_PATHS = (r'^/api/',)
+        constants.MIDDLEWARE_EXCLUDE_PATHS = (r'^/api/health/',)
+
+        try:
+            with self.assertNumQueries(0):
+                for path in ('/static/app.js', '/api/health/'):
+                    request = self._request(token.token, path=path)
+                    self.assertFalse(request.user.is_authenticated())
+                    self.assertFalse(request.oauth2_token)
+
+            request = self._request(token.token, path='/api/me/')
+            self.assertTrue(request.user.is_authenticated())
+        finally:
+            constants.MIDDLEWARE_INCLUDE_PATHS = self._include
+            constants.MIDDLEWARE_EXCLUDE_PATHS = self._exclude
+
+    def test_post_body_only_read_for_forms(self):
+        token = AccessToken.objects.create(user=self.get_user(),
+            client=self.get_client(), scope=constants.READ)
+
+        request = RequestFactory().post('/api/', {'access_token': token.token})
+        AuthenticationMiddleware().process_request(request)
+        self.assertTrue(request.oauth2_token)
+
+        request = RequestFactory().post('/api/',
+            json.dumps({'access_token': token.token}),
+            content_type='application/json')
+        AuthenticationMiddleware().process_request(request)
+        self.assertFalse(request.oauth2_token)
+        self.assertFalse(hasattr(request, '_post'))
+
+    def test_token_cache(self):
+        self._token_cache = constants.TOKEN_CACHE
+        constants.TOKEN_CACHE = 'default'
+        token = AccessToken.objects.create(user=self.get_user(),
+            client=self.get_client(), scope=constants.READ)
+
+        try:
+            with self.assertNumQueries(1):
+                self.assertTrue(self._request(token.token).oauth2_token)
+            with self.assertNumQueries(0):
+                principal = self._request(token.token).oauth2_token
+                self.assertEqual(token.pk, principal.token_id)
+
+            token.expires = date_now() - datetime.timedelta(days=1)
+            token.save()
+
+            with self.assertNumQueries(1):
+                self.assertFalse(self._request(token.token).oauth2_token)
+        finally:
+            constants.TOKEN_CACHE = self._token_cache
+
+    def test_token_cache_skips_tokens_without_user(self):
+        self._token_cache = constants.TOKEN_CACHE
+        constants.TOKEN_CACHE = 'default'
+        token = AccessToken.objects.create(client=self.get_client(),
+            scope=constants.READ)
+        key = token_cache_key(token.token)
+
+        try:
+            AccessToken.objects.remember(token)
+            self.assertIsNone(caches['default'].get(key))
+
+            caches['default'].set(key, (token.pk, None, token.client_id,
+                                        token.scope, token.expires))
+            self.assertFalse(self._request(token.token).oauth2_token)
+        finally:
+            caches['default'].delete(key)
+            constants.TOKEN_CACHE = self._token_cache
+
+    def test_require_scope(self):
+        view = require_scope('write')(lambda request: 'ok')
+        token = AccessToken.objects.create(user=self.get_user(),
+            client=self.get_client(), scope=constants.READ)
+
+        response = view(self._request())
+        self.assertEqual(401, response.status_code)
+        self.assertEqual('Bearer', response['WWW-Authenticate'])
+
+        response = view(self._request('unknown'))
+        self.assertEqual(401, response.status_code)
+        self.assertEqual('Bearer error="invalid_token"', response['WWW-Authenticate'])
+
+        request = self._request(token.token)
+        response = view(request)
+        self.assertEqual(403, response.status_code)
+        self.assertEqual('insufficient_scope',
+            json.loads(response.content)['error'])
+
+        token.scope = constants.READ_WRITE
+        token.save()
+
+        request = self._request(token.token)
+        with self.assertNumQueries(1):
+            self.assertEqual('ok', view(request))
+            self.assertEqual(token.user_id, request.oauth2_token.user_id)
+
+    def test_require_scope_rejects_unknown_names(self):
+        self.assertRaises(ImproperlyConfigured, require_scope, 'wirte')
+        self.assertRaises(ImproperlyConfigured, require_scope, 'read wirte')
+
+        class ScopedView(ScopeRequiredMixin, View):
+            required_scope = 'wirte'
+
+        self.assertRaises(ImproperlyConfigured, ScopedView.as_view)
+        self.assertTrue(ScopedView.as_view(required_scope='read'))
+
+    def test_bearer_authorization_header(self):
+        token = AccessToken.objects.create(user=self.get_user(),
+            client=self.get_client(), scope=constants.READ)
+
+        request = RequestFactory().get('/api/')
+        request.META['HTTP_AUTHORIZATION'] = 'Bearer {}'.format(token.token)
+        AuthenticationMiddleware().process_request(request)
+        self.assertEqual(token.pk, request.oauth2_token.token_id)
+
+
 class EnforceSecureTest(BaseOAuth2TestCase):
     fixtures = ['test_oauth2']
 
@@ -885,3 +1584,177 @@ class DeleteExpiredTest(BaseOAuth2TestCase):
                          .exists())
         self.assertFalse(RefreshToken.objects.filter(token=refresh_token)
                          .exists())
+
+
+class PartitionTokensTest(BaseOAuth2TestCase):
+    fixtures = ['test_oauth2']
+
+    def test_month_arithmetic(self):
+        self.assertEqual(datetime.date(2025, 1, 1),
+                         partitions.add_months(datetime.date(2024, 12, 1), 1))
+        self.assertEqual(datetime.date(2023, 12, 1),
+                         partitions.add_months(datetime.date(2024, 12, 1), -12))
+        self.assertEqual('oauth2_accesstoken_p202403',
+                         partitions.partition_name(datetime.date(2024, 3, 1)))
+
+    def test_partitions_are_kept_a_month_ahead(self):
+        with patch('provider.oauth2.partitions.longest_lifetime',
+                   return_value=datetime.timedelta(days=1)):
+            self.assertEqual(datetime.date(2025, 2, 1), partitions.last_needed_month(
+                datetime.datetime(2024, 12, 31, 12)))
+
+    def test_falls_back_to_deleting_rows(self):
+        AccessToken.objects.create(user=self.get_user(), client=self.get_client(),
+                                   expires=date_now() - datetime.timedelta(days=1))
+        live = AccessToken.objects.create(user=self.get_user(),
+                                          client=self.get_client())
+
+        call_command('partition_tokens', stdout=StringIO())
+
+        self.assertEqual([live.pk], list(AccessToken.objects.values_list('pk', flat=True)))
+
+
+class CleanTokensTest(BaseOAuth2TestCase):
+    fixtures = ['test_oauth2']
+
+    def _create(self, expires):
+        return AccessToken.objects.create(user=self.get_user(),
+                                          client=self.get_client(),
+                                          expires=expires)
+
+    def test_only_scans_since_last_run(self):
+        call_command('clean_tokens', stdout=StringIO())
+        watermark = CleanupWatermark.objects.get(name='access tokens').value
+
+        old = self._create(watermark - datetime.timedelta(days=7))
+        recent = self._create(date_now() - datetime.timedelta(days=1))
+        live = self._create(date_now() + datetime.timedelta(days=1))
+
+        call_command('clean_tokens', stdout=StringIO())
+        self.assertEqual(set([old.pk, live.pk]),
+                         set(AccessToken.objects.values_list('pk', flat=True)))
+        self.assertFalse(AccessToken.objects.filter(pk=recent.pk).exists())
+        self.assertTrue(CleanupWatermark.objects.get(name='access tokens').value > watermark)
+
+        call_command('clean_tokens', full=True, stdout=StringIO())
+        self.assertEqual([live.pk], list(AccessToken.objects.values_list('pk', flat=True)))
+
+
+class SweepOrphansTest(BaseOAuth2TestCase):
+    fixtures = ['test_oauth2']
+
+    def test_sweep_orphans(self):
+        user, client = self.get_user(), self.get_client()
+        live = AccessToken.objects.create(user=user, client=client)
+        live_rt = RefreshToken.objects.create(user=user, client=client,
+                                              access_token=live)
+        deleted = AccessToken.objects.create(user=user, client=client,
+                                             is_deleted=True)
+        RefreshToken.objects.create(user=user, client=client,
+                                    access_token=deleted)
+        dangling = AccessToken.objects.create(user=user, client=client)
+        RefreshToken.objects.create(user=user, client=client,
+                                    access_token=dangling)
+        AccessToken.objects.filter(pk=dangling.pk)._raw_delete('default')
+
+        out = StringIO()
+        call_command('sweep_orphans', batch_size=1, stdout=out)
+
+        self.assertIn('Removed 1 refresh tokens of deleted access tokens', out.getvalue())
+        self.assertIn('Removed 1 refresh tokens without access token', out.getvalue())
+        self.assertIn('Removed 1 deleted access tokens', out.getvalue())
+        self.assertEqual([live.pk], list(AccessToken.objects.values_list('pk', flat=True)))
+        self.assertEqual([live_rt.pk], list(RefreshToken.objects.values_list('pk', flat=True)))
+
+
+class ReaperTest(BaseOAuth2TestCase):
+    fixtures = ['test_oauth2']
+
+    def setUp(self):
+        self.cache = LocMemCache('provider.oauth2.tests', {})
+
+    def test_leader_removes_expired_rows(self):
+        user, client = self.get_user(), self.get_client()
+        expired = AccessToken.objects.create(
+            user=user, client=client,
+            expires=date_now() - datetime.timedelta(days=1))
+        RefreshToken.objects.create(user=user, client=client, access_token=expired)
+        live = AccessToken.objects.create(user=user, client=client)
+
+        leader = Reaper(60, 1, 10, self.cache)
+        follower = Reaper(60, 1, 10, self.cache)
+
+        self.assertEqual(1, leader.run_once()['access tokens'])
+        self.assertIsNone(follower.run_once())
+        self.assertEqual(0, leader.run_once()['access tokens'])
+
+        self.assertEqual([live.pk], list(AccessToken.objects.values_list('pk', flat=True)))
+        self.assertFalse(RefreshToken.objects.exists())
+        self.assertEqual(1, leader.removed['refresh tokens of expired access tokens'])
+        self.assertEqual(2, leader.runs)
+
+    def test_started_by_served_requests_only(self):
+        with patch('provider.oauth2.reaper.start_reaper') as start_reaper:
+            self.client.get('/')
+            self.assertFalse(start_reaper.called)
+
+            start_reaper_on_request(sender=WSGIHandler)
+            self.assertTrue(start_reaper.called)
+
+
+class UsageBufferTest(BaseOAuth2TestCase):
+    fixtures = ['test_oauth2']
+
+    def _create(self):
+        return AccessToken.objects.create(user=self.get_user(),
+                                          client=self.get_client())
+
+    def test_flush_writes_latest_use(self):
+        first, second, unused = self._create(), self._create(), self._create()
+        buffer = UsageBuffer(flush_interval=60, max_size=100, batch_size=1)
+        earlier = date_now() - datetime.timedelta(minutes=5)
+        later = date_now()
+
+        with self.assertNumQueries(0):
+            buffer.touch(first.pk, earlier)
+            buffer.touch(first.pk, later)
+            buffer.touch(second.pk, earlier)
+        self.assertEqual(2, len(buffer))
+
+        # One update per batch, inside a savepoint
+        with self.assertNumQueries(4):
+            self.assertEqual(2, buffer.flush())
+
+        self.assertEqual(later, AccessToken.objects.get(pk=first.pk).last_used)
+        self.assertEqual(earlier, AccessToken.objects.get(pk=second.pk).last_used)
+        self.assertIsNone(AccessToken.objects.get(pk=unused.pk).last_used)
+        self.assertEqual(0, len(buffer))
+
+    def test_flush_when_full(self):
+        token, other = self._create(), self._create()
+        buffer = UsageBuffer(flush_interval=60, max_size=2)
+
+        with self.assertNumQueries(0):
+            buffer.touch(token.pk)
+            self.assertEqual(0, buffer.flush_if_due())
+            buffer.touch(other.pk)
+
+        self.assertEqual(2, buffer.flush_if_due())
+        self.assertEqual(0, len(buffer))
+        self.assertIsNotNone(AccessToken.objects.get(pk=token.pk).last_used)
+
+    def test_flush_after_request(self):
+        self._buffer = usage._buffer
+        usage._buffer = UsageBuffer(flush_interval=0, max_size=100)
+        token = self._create()
+
+        try:
+            usage._buffer.touch(token.pk)
+            with patch('provider.oauth2.usage.close_old_connections') as close:
+                usage.flush_usage(sender=self.__class__)
+            self.assertTrue(close.called)
+            self.assertEqual(0, len(usage._buffer))
+            self.assertIsNotNone(AccessToken.objects.get(pk=token.pk).last_used)
+        finally:
+            usage._buffer = self._buffer
+
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Write-behind tracking of :attr:`provider.oauth2.models.AccessToken.last_used`.
+
+With :attr:`provider.constants.TRACK_LAST_USED` enabled the middleware
+records every token it authenticates in a per process buffer instead of
+writing to the database. The buffer keeps the latest time per token and is
+written with one ``UPDATE ... SET last_used = CASE id WHEN ... END`` per
+batch once :attr:`provider.constants.LAST_USED_FLUSH_INTERVAL` seconds have
+passed or :attr:`provider.constants.LAST_USED_BUFFER_SIZE` tokens are
+buffered. The buffer is written from the ``request_finished`` signal, after
+the response and outside of any ``ATOMIC_REQUESTS`` transaction, so a slow
+or failing write never holds up or rolls back a request. Times still
+buffered when a process dies are lost.
+"""
+from __future__ import unicode_literals
+
+import atexit
+import logging
+import threading
+import time
+
+from django.db import close_old_connections, router, transaction
+from django.db.models import Case, DateTimeField, Value, When
+
+from .. import constants
+from ..utils import now
+from .models import AccessToken
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+class UsageBuffer(object):
+    """
+    Coalesces last use times per access token primary key in memory.
+    """
+    def __init__(self, flush_interval, max_size, batch_size=BATCH_SIZE):
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self._used = {}
+        self._lock = threading.Lock()
+        self._flushed = time.time()
+
+    def __len__(self):
+        return len(self._used)
+
+    def touch(self, token_id, when=None):
+        """
+        Record that the access token ``token_id`` was used at ``when``.
+        """
+        with self._lock:
+            self._used[token_id] = when or now()
+
+    def is_due(self):
+        return bool(self._used) and (
+            len(self._used) >= self.max_size or
+            time.time() - self._flushed >= self.flush_interval)
+
+    def flush_if_due(self):
+        """
+        Flush if the buffer is full or the flush interval has passed. Errors
+        are logged and the buffered times dropped.
+        """
+        if not self.is_due():
+            return 0
+        try:
+            return self.flush()
+        except Exception:
+            logger.exception('Writing access token last use failed')
+            return 0
+
+    def flush(self):
+        """
+        Write the buffered times and return the number of tokens updated.
+        The updates run in their own transaction, or savepoint if one is
+        already open.
+        """
+        with self._lock:
+            used, self._used = self._used, {}
+            self._flushed = time.time()
+
+        items = sorted(used.items())
+        with transaction.atomic(using=router.db_for_write(AccessToken)):
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                AccessToken.all_objects.filter(pk__in=[pk for pk, when in batch]).update(
+                    last_used=Case(*[When(pk=pk, then=Value(when)) for pk, when in batch],
+                                   output_field=DateTimeField()))
+        return len(items)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_usage_buffer():
+    """
+    Return the usage buffer of this process, flushed when it exits.
+    """
+    global _buffer
+
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                buffer = UsageBuffer(constants.LAST_USED_FLUSH_INTERVAL,
+                                     constants.LAST_USED_BUFFER_SIZE)
+                atexit.register(buffer.flush)
+                _buffer = buffer
+    return _buffer
+
+
+def flush_usage(**kwargs):
+    """
+    ``request_finished`` receiver flushing the usage buffer of this process
+    if it is due. Django's own receiver closed the request's connection
+    already, so the one opened for the flush is released the same way.
+    """
+    if _buffer is not None and _buffer.is_due():
+        _buffer.flush_if_due()
+        close_old_connections()
+
+
+def token_used(principal):
+    """
+    Record the use of the token behind ``principal`` if
+    :attr:`provider.constants.TRACK_LAST_USED` is set. Tokens without a
+    database row are not tracked.
+    """
+    if constants.TRACK_LAST_USED and principal.token_id is not None:
+        get_usage_buffer().touch(principal.token_id)
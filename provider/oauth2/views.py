@@ -1,6 +1,4 @@
-from datetime import timedelta
 from django.core.urlresolvers import reverse
-from .. import constants
 from ..views import (
     Capture, Authorize, Redirect, AccessToken as AccessTokenView, OAuthError)
 from ..utils import now
@@ -8,8 +6,9 @@ from .forms import (
     AuthorizationCodeGrantForm, PasswordGrantForm, EmailAndPasswordGrantForm,
     RefreshTokenGrantForm, AuthorizationRequestForm, AuthorizationForm,
     ClientCredentialsGrantForm)
-from .models import Client, RefreshToken, AccessToken
+from .models import Client, RefreshToken, AccessToken, Consent
 from .backends import BasicClientBackend, RequestParamsClientBackend, PublicClientBackend
+from .storage import get_grant_storage, get_token_storage
 
 
 class Capture(Capture):
@@ -31,14 +30,16 @@ class Authorize(Authorize):
         return AuthorizationForm(data)
 
     def get_client(self, client_id):
-        try:
-            return Client.objects.get(client_id=client_id)
-        except Client.DoesNotExist:
-            return None
+        return Client.objects.get_by_client_id(client_id)
 
     def get_redirect_url(self, request):
         return reverse('oauth2:redirect')
 
+    def is_already_authorized(self, request, client, data):
+        # Without a requested scope the resource owner picks one in the form
+        wants = data.get('scope') or 0
+        return wants != 0 and Consent.objects.is_granted(request.user, client, wants)
+
     def save_authorization(self, request, client, form, client_data):
 
         grant = form.save(commit=False)
@@ -49,7 +50,8 @@ class Authorize(Authorize):
         grant.user = request.user
         grant.client = client
         grant.redirect_uri = client_data.get('redirect_uri', '')
-        grant.save()
+        get_grant_storage().save(grant)
+        Consent.objects.grant(request.user, client, grant.scope)
         return grant.code
 
 
@@ -57,7 +59,6 @@ class Redirect(Redirect):
     """
     Implementation of :class:`provider.views.Redirect`
     """
-    pass
 
 
 class AccessTokenView(AccessTokenView):
@@ -123,37 +124,33 @@ class AccessTokenView(AccessTokenView):
                                        scope=scope, expires__gt=now()).exclude(pk=at.pk).delete()
         return at
 
+    def get_issued_access_token(self, request, scope, client):
+        return AccessToken.objects.get_issued(client, scope)
+
+    def remember_issued_access_token(self, request, access_token):
+        AccessToken.objects.remember_issued(access_token)
+
     def create_access_token(self, request, user, scope, client):
-        return AccessToken.objects.create(
-            user=user,
-            client=client,
-            scope=scope
-        )
+        return get_token_storage().create_access_token(user, client, scope)
+
+    def create_refreshed_access_token(self, request, rt, client):
+        return get_token_storage().create_access_token(
+            rt.user, client, rt.access_token.scope, family=rt.family)
 
     def create_refresh_token(self, request, user, scope, access_token, client):
-        return RefreshToken.objects.create(
-            user=user,
-            access_token=access_token,
-            client=client
-        )
+        return get_token_storage().create_refresh_token(user, client, access_token)
+
+    def claim_refresh_token(self, rt):
+        return get_token_storage().claim_refresh_token(rt)
 
     def update_refresh_token(self, rt, at):
-        rt.access_token = at
-        rt.save()
+        return get_token_storage().update_refresh_token(rt, at)
 
     def invalidate_grant(self, grant):
-        if constants.DELETE_EXPIRED:
-            grant.delete()
-        else:
-            grant.expires = now() - timedelta(days=1)
-            grant.save()
+        get_grant_storage().invalidate(grant)
 
     def invalidate_refresh_token(self, rt):
-        if constants.DELETE_EXPIRED:
-            rt.delete()
-        else:
-            rt.expired = True
-            rt.save()
+        get_token_storage().invalidate_refresh_token(rt)
 
     def invalidate_refresh_tokens_over_limit(self, user, scope, client, limit):
         if limit > 0:
@@ -166,8 +163,4 @@ class AccessTokenView(AccessTokenView):
                 self.invalidate_refresh_token(rt)
 
     def invalidate_access_token(self, at):
-        if constants.DELETE_EXPIRED:
-            at.delete()
-        else:
-            at.expires = now() - timedelta(days=1)
-            at.save()
+        get_token_storage().invalidate_access_token(at)
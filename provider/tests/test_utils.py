@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import json
 from datetime import datetime, time, date
 
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.test import TestCase
 
 from .. import utils
+from ..oauth2.models import Client
 
 
 class UtilsTestCase(TestCase):
@@ -34,3 +38,50 @@ class UtilsTestCase(TestCase):
             #   datetime.time(10, 6, 28, 705000)
             self.assertEqual(int(t1.microsecond/1000),
                              int(t2.microsecond/1000))
+
+    def test_serialization_matches_json_round_trip(self):
+        user = get_user_model()(pk=1, username='test', date_joined=utils.now())
+        user.extra = {'when': date.today(), 'values': (1, 'two')}
+        expected = json.loads(json.dumps(
+            dict((k, v) for k, v in user.__dict__.items() if not k.startswith('_')),
+            cls=DjangoJSONEncoder))
+        self.assertEqual(expected, utils.serialize_instance(user))
+        self.assertEqual(None, utils.serialize_instance(None))
+
+    def test_client_serialization(self):
+        user = get_user_model()(pk=1, username='test', date_joined=utils.now())
+        client = Client(user=user, name='test', url='http://example.com/',
+                        redirect_uri='http://example.com/application/1/',
+                        client_id='id', client_secret='secret', client_type=1)
+        data = json.loads(json.dumps(client.serialize()))
+        client2 = Client.deserialize(data)
+        self.assertEqual(client.client_id, client2.client_id)
+        self.assertEqual(client.redirect_uri, client2.redirect_uri)
+        self.assertEqual(client.client_type, client2.client_type)
+        self.assertEqual(user.username, client2.user.username)
+        self.assertEqual(user.date_joined.date(), client2.user.date_joined.date())
+
+    def test_redirect_uri_matcher(self):
+        matcher = utils.get_redirect_uri_matcher(
+            'http://example.com/a/ http://example.com/b/*')
+        self.assertTrue(matcher is utils.get_redirect_uri_matcher(
+            'http://example.com/a/ http://example.com/b/*'))
+        self.assertEqual('http://example.com/a/', matcher.default)
+        self.assertTrue(matcher.match('http://example.com/a/'))
+        self.assertFalse(matcher.match('http://example.com/a/x'))
+        self.assertTrue(matcher.match('http://example.com/b/'))
+        self.assertTrue(matcher.match('http://example.com/b/x?y=1'))
+        self.assertFalse(matcher.match('http://example.com/bx'))
+        self.assertFalse(matcher.match('http://example.com/b/../admin/'))
+        self.assertFalse(matcher.match('http://example.com/b/%2e%2E/admin/'))
+        self.assertFalse(matcher.match('http://example.com/b/./x'))
+        self.assertTrue(matcher.match('http://example.com/b/x..y/'))
+        self.assertFalse(matcher.match('http://example.com/b/..\\..\\admin'))
+        self.assertFalse(matcher.match('http://example.com/b/..%5c..%5Cadmin'))
+        self.assertFalse(matcher.match('http://example.com/b/.\t./admin'))
+
+        matcher = utils.get_redirect_uri_matcher(
+            'http://example.com/b/* http://example.com/a/')
+        self.assertEqual('http://example.com/a/', matcher.default)
+        self.assertIsNone(utils.get_redirect_uri_matcher(
+            'http://example.com/b/*').default)
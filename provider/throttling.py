@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers to protect the token endpoint from load it cannot absorb. See
+:attr:`provider.constants.PASSWORD_HASH_CONCURRENCY`,
+:attr:`provider.constants.LOGIN_FAILURE_WINDOW` and
+:attr:`provider.constants.CLIENT_RATE_LIMITS`.
+"""
+from __future__ import unicode_literals
+
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import InvalidCacheBackendError
+from django.core.cache.backends.locmem import LocMemCache
+
+from . import constants
+from .utils import get_cache
+
+
+class Overloaded(Exception):
+    """
+    Raised when a limiter can not hand out a slot in time.
+    """
+
+
+class ConcurrencyLimiter(object):
+    """
+    Bounds the number of threads running a block of code at the same time.
+
+    At most ``limit`` callers run concurrently and at most ``queue_depth``
+    more wait for a slot, each for no longer than ``timeout`` seconds. Any
+    caller beyond that raises :class:`Overloaded` right away instead of
+    piling up behind the others.
+
+    :example:
+
+    ::
+
+        limiter = ConcurrencyLimiter(4, queue_depth=16, timeout=2)
+
+        with limiter:
+            user = authenticate(username=username, password=password)
+    """
+    def __init__(self, limit, queue_depth=0, timeout=None):
+        self.limit = limit
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+
+    def acquire(self):
+        with self._condition:
+            if self._active >= self.limit:
+                if self._waiting >= self.queue_depth:
+                    raise Overloaded()
+                self._waiting += 1
+                try:
+                    self._wait()
+                finally:
+                    self._waiting -= 1
+            self._active += 1
+
+    def _wait(self):
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        while self._active >= self.limit:
+            if deadline is None:
+                self._condition.wait()
+                continue
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise Overloaded()
+            self._condition.wait(remaining)
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+_password_limiter = None
+
+
+def get_password_limiter():
+    """
+    Return the process wide :class:`ConcurrencyLimiter` for password hashing
+    configured through :attr:`provider.constants.PASSWORD_HASH_CONCURRENCY`
+    or ``None`` if hashing is not limited.
+    """
+    global _password_limiter
+
+    config = (constants.PASSWORD_HASH_CONCURRENCY,
+              constants.PASSWORD_HASH_QUEUE_DEPTH,
+              constants.PASSWORD_HASH_TIMEOUT)
+
+    if config[0] <= 0:
+        return None
+
+    limiter = _password_limiter
+    if limiter is None or (limiter.limit, limiter.queue_depth, limiter.timeout) != config:
+        limiter = _password_limiter = ConcurrencyLimiter(*config)
+    return limiter
+
+
+@contextmanager
+def password_hashing():
+    """
+    Context manager around credential verification. Raises
+    :class:`Overloaded` when too many passwords are being hashed already.
+    """
+    limiter = get_password_limiter()
+
+    if limiter is None:
+        yield
+        return
+
+    with limiter:
+        yield
+
+
+_local_cache = LocMemCache('provider.throttling', {})
+
+
+def get_throttling_cache():
+    """
+    Return the cache configured through :attr:`provider.constants.THROTTLING_CACHE`
+    or a process local in-memory cache if none is available.
+    """
+    try:
+        cache = get_cache(constants.THROTTLING_CACHE)
+    except InvalidCacheBackendError:
+        cache = None
+    return cache if cache is not None else _local_cache
+
+
+class FailureCounter(object):
+    """
+    Counts events per key over a sliding window of ``window`` seconds.
+
+    The window is split into ``buckets`` slices, each stored as its own cache
+    key that expires on its own, so counting costs a single ``get_many`` and
+    recording a single ``incr``.
+    """
+    def __init__(self, cache, window, buckets=6, prefix='oauth2:failures'):
+        self.cache = cache
+        self.window = window
+        self.buckets = buckets
+        self.prefix = prefix
+        self.bucket_size = max(1, int(window) // buckets)
+
+    def _bucket_keys(self, key, reference):
+        current = int(reference) // self.bucket_size
+        return ['{}:{}:{}'.format(self.prefix, key, bucket)
+                for bucket in range(current - self.buckets + 1, current + 1)]
+
+    def counts(self, keys):
+        """
+        Return a dict mapping each of ``keys`` to its number of events in the
+        current window.
+        """
+        reference = time.time()
+        bucket_keys = dict((key, self._bucket_keys(key, reference)) for key in keys)
+        values = self.cache.get_many([k for ks in bucket_keys.values() for k in ks])
+        return dict((key, sum(values.get(k, 0) for k in ks))
+                    for key, ks in bucket_keys.items())
+
+    def incr(self, key):
+        bucket_key = self._bucket_keys(key, time.time())[-1]
+        timeout = self.window + self.bucket_size
+        self.cache.add(bucket_key, 0, timeout)
+        try:
+            self.cache.incr(bucket_key)
+        except ValueError:
+            # The bucket expired between add and incr
+            self.cache.set(bucket_key, 1, timeout)
+
+
+LOGIN_FAILURE_ERRORS = ('authentication_failed', 'invalid_grant', 'invalid_credentials')
+"""
+Errors returned by password grants that count as a failed login.
+"""
+
+
+def _login_failure_limits(request, data, client):
+    username = data.get('username') or data.get('email')
+    limits = (
+        (constants.LOGIN_FAILURE_LIMIT_USERNAME, 'username', username.lower() if username else None),
+        (constants.LOGIN_FAILURE_LIMIT_CLIENT, 'client', client.client_id),
+        (constants.LOGIN_FAILURE_LIMIT_IP, 'ip', request.META.get('REMOTE_ADDR')),
+    )
+    return dict(('{}:{}'.format(kind, value), limit)
+                for limit, kind, value in limits
+                if limit > 0 and value)
+
+
+def get_login_failure_counter():
+    window = constants.LOGIN_FAILURE_WINDOW
+    return FailureCounter(get_throttling_cache(),
+                          window.days * 86400 + window.seconds,
+                          prefix='oauth2:login-failures')
+
+
+def login_blocked(request, data, client):
+    """
+    Return ``True`` if the username, client or remote address of a password
+    grant failed to log in too often within
+    :attr:`provider.constants.LOGIN_FAILURE_WINDOW`.
+    """
+    limits = _login_failure_limits(request, data, client)
+    if not limits:
+        return False
+    counts = get_login_failure_counter().counts(limits.keys())
+    return any(counts[key] >= limit for key, limit in limits.items())
+
+
+def record_login_failure(request, data, client):
+    """
+    Count a failed password grant against its username, client and remote
+    address.
+    """
+    limits = _login_failure_limits(request, data, client)
+    if not limits:
+        return
+    counter = get_login_failure_counter()
+    for key in limits:
+        counter.incr(key)
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter stored in a cache. Each key may spend up to
+    ``capacity`` tokens in a burst, refilled at ``rate`` tokens per second.
+
+    The bucket is read and written without locking, so concurrent requests
+    may occasionally overspend by a token or two. That is fine for shielding
+    the database from a runaway client.
+    """
+    def __init__(self, cache, rate, capacity, prefix='oauth2:bucket'):
+        self.cache = cache
+        self.rate = float(rate)
+        self.capacity = capacity
+        self.prefix = prefix
+
+    def consume(self, key, tokens=1):
+        """
+        Take ``tokens`` from the bucket of ``key``. Return ``0`` on success or
+        the number of seconds until enough tokens are available.
+        """
+        cache_key = '{}:{}'.format(self.prefix, key)
+        reference = time.time()
+        timeout = int(self.capacity / self.rate) + 1
+
+        state = self.cache.get(cache_key)
+        if state is None:
+            level = self.capacity
+        else:
+            level, stamp = state
+            level = min(self.capacity, level + (reference - stamp) * self.rate)
+
+        if level < tokens:
+            self.cache.set(cache_key, (level, reference), timeout)
+            return (tokens - level) / self.rate
+
+        self.cache.set(cache_key, (level - tokens, reference), timeout)
+        return 0
+
+
+def get_client_rate_limit(client):
+    """
+    Return the ``(rate, burst)`` limit that applies to ``client`` from
+    :attr:`provider.constants.CLIENT_RATE_LIMITS` or ``None``. A limit for
+    the client's ``client_id`` wins over one for its client type
+    (``'public'`` or ``'confidential'``), which wins over ``'default'``.
+    """
+    limits = constants.CLIENT_RATE_LIMITS
+    if not limits:
+        return None
+
+    client_type = 'public' if client.client_type == constants.PUBLIC else 'confidential'
+    for key in (client.client_id, client_type, 'default'):
+        if key in limits:
+            return limits[key]
+    return None
+
+
+def client_rate_limited(client):
+    """
+    Spend one request from the token bucket of ``client``. Return ``0`` if
+    the request may proceed or the number of seconds to wait otherwise.
+    """
+    limit = get_client_rate_limit(client)
+    if limit is None:
+        return 0
+
+    rate, burst = limit
+    bucket = TokenBucket(get_throttling_cache(), rate, burst,
+                         prefix='oauth2:client-bucket')
+    return bucket.consume(client.client_id)
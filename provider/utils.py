@@ -2,13 +2,16 @@
 from __future__ import unicode_literals
 
 import hashlib
+import re
+import urllib
+import urlparse
+
 import shortuuid
-import json
 
 from django.conf import settings
+from django.core.cache import caches
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db.models.fields import (
-    DateTimeField, DateField, TimeField, FieldDoesNotExist)
+from django.db.models.fields import DateTimeField, DateField, TimeField
 from django.utils import dateparse, timezone
 from .constants import EXPIRE_DELTA, EXPIRE_DELTA_PUBLIC, EXPIRE_CODE_DELTA
 
@@ -62,6 +65,120 @@ def get_code_expiry():
     return now() + EXPIRE_CODE_DELTA
 
 
+def get_cache(alias):
+    """
+    Return the cache configured under ``alias`` in :attr:`settings.CACHES`
+    or ``None`` if ``alias`` is ``None``.
+    """
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+# Characters browsers drop from URLs before resolving them
+_browser_stripped_re = re.compile(r'[\t\r\n]')
+
+
+class RedirectURIMatcher(object):
+    """
+    Matches redirect URIs against the space separated list of URIs registered
+    for a client. URIs are compared as plain strings as recommended in
+    :rfc:`3.1.2.3`. A registered URI ending in ``/*`` matches every URI that
+    starts with it up to and including the slash, unless its path contains
+    ``.`` or ``..`` segments that would resolve outside of the prefix. The
+    path is normalised like browsers do first: tabs and newlines are removed
+    and backslashes count as slashes.
+
+    :attr:`default` is the first registered URI without a wildcard, or
+    ``None`` if there is none and clients have to pass ``redirect_uri``.
+    """
+    def __init__(self, redirect_uri):
+        uris = [uri for uri in redirect_uri.split(" ") if uri]
+        self.exact = frozenset(uris)
+        self.prefixes = tuple(uri[:-1] for uri in uris if uri.endswith('/*'))
+        self.default = next((uri for uri in uris if not uri.endswith('/*')), None)
+
+    def match(self, uri):
+        """
+        Return ``True`` if ``uri`` is one of the registered redirect URIs.
+        """
+        if uri in self.exact:
+            return True
+        if not self.prefixes or not uri.startswith(self.prefixes):
+            return False
+        path = urlparse.urlsplit(_browser_stripped_re.sub('', uri)).path
+        path = urllib.unquote(path).replace('\\', '/')
+        return not any(segment in ('.', '..') for segment in path.split('/'))
+
+
+_redirect_uri_matchers = {}
+
+
+def get_redirect_uri_matcher(redirect_uri):
+    """
+    Return a :class:`RedirectURIMatcher` for the registered ``redirect_uri``.
+    Matchers are built once per distinct value, so updating a client's
+    redirect URIs picks up a new matcher right away.
+    """
+    try:
+        return _redirect_uri_matchers[redirect_uri]
+    except KeyError:
+        pass
+
+    if len(_redirect_uri_matchers) >= 1024:
+        _redirect_uri_matchers.clear()
+    matcher = _redirect_uri_matchers[redirect_uri] = RedirectURIMatcher(redirect_uri)
+    return matcher
+
+
+_json_encoder = DjangoJSONEncoder()
+
+_JSON_NATIVE_TYPES = (type(None), bool, int, long, float, str, unicode)
+
+
+def _to_json(value):
+    """
+    Convert ``value`` to what ``json.loads(json.dumps(value,
+    cls=DjangoJSONEncoder))`` would return, without the round trip.
+    """
+    if isinstance(value, _JSON_NATIVE_TYPES):
+        return value
+    if isinstance(value, dict):
+        return dict((unicode(k), _to_json(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    return _json_encoder.default(value)
+
+
+_field_parsers = {}
+
+
+def _get_field_parsers(model):
+    """
+    Return a dict mapping the field names and attribute names of ``model`` to
+    the function parsing their serialized value. Computed once per model.
+    """
+    try:
+        return _field_parsers[model]
+    except KeyError:
+        pass
+
+    parsers = {}
+    for f in model._meta.fields:
+        if isinstance(f, DateTimeField):
+            parser = dateparse.parse_datetime
+        elif isinstance(f, TimeField):
+            parser = dateparse.parse_time
+        elif isinstance(f, DateField):
+            parser = dateparse.parse_date
+        else:
+            continue
+        parsers[f.name] = parsers[f.attname] = parser
+
+    _field_parsers[model] = parsers
+    return parsers
+
+
 def serialize_instance(instance):
     """
     Since Django 1.6 items added to the session are no longer pickled,
@@ -71,11 +188,10 @@ def serialize_instance(instance):
     Serialization will start complaining about missing relations et al.
     """
     if instance is None:
-        return json.loads(json.dumps(None, cls=DjangoJSONEncoder))
-    ret = dict([(k, v)
+        return None
+    return dict((k, _to_json(v))
                 for k, v in instance.__dict__.items()
-                if not k.startswith('_')])
-    return json.loads(json.dumps(ret, cls=DjangoJSONEncoder))
+                if not k.startswith('_'))
 
 
 def deserialize_instance(model, data={}):
@@ -84,18 +200,10 @@ def deserialize_instance(model, data={}):
     This (and the whole session caching) is janky and should be re-thought.
     The spec offers an optional "state" param that could be used for this instead
     """
+    parsers = _get_field_parsers(model)
     ret = model()
     for k, v in data.items():
-        if v is not None:
-            try:
-                f = model._meta.get_field(k)
-                if isinstance(f, DateTimeField):
-                    v = dateparse.parse_datetime(v)
-                elif isinstance(f, TimeField):
-                    v = dateparse.parse_time(v)
-                elif isinstance(f, DateField):
-                    v = dateparse.parse_date(v)
-            except FieldDoesNotExist:
-                pass
+        if isinstance(v, basestring) and k in parsers:
+            v = parsers[k](v)
         setattr(ret, k, v)
     return ret
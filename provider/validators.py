@@ -4,10 +4,12 @@ from __future__ import unicode_literals
 from django.core.validators import URLValidator
 
 
+_url_validator = URLValidator()
+
+
 def validate_uris(value):
     """
     Validates the `value` contains valid space separated urls
     """
-    v = URLValidator()
     for uri in value.split(" "):
-        v(uri)
+        _url_validator(uri)
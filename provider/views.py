@@ -1,17 +1,20 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 import json
+import math
 import urlparse
 import logging
 
+from django.core import signing
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.http import HttpResponse, QueryDict
 from django.utils.timezone import now
 from django.utils.translation import ugettext as _
 from django.views.generic.base import TemplateView
 
 from oauth2.models import Client, ClientStatus
-from . import constants, scope
+from . import constants, scope, throttling
 from provider.compat.http import JsonResponse
 from provider.oauth2.models import AccessToken as AccessTokenModel
 
@@ -42,6 +45,51 @@ class OAuthError(Exception):
     """
 
 
+STATE_SALT = 'provider.views.state'
+
+
+def _state_max_age():
+    return constants.EXPIRE_CODE_DELTA.days * 86400 + constants.EXPIRE_CODE_DELTA.seconds
+
+
+def _get_state(request):
+    """
+    Return the flow state carried in the signed state cookie of ``request``.
+    Missing, tampered or expired cookies yield an empty state.
+    """
+    if not hasattr(request, '_oauth_state'):
+        state = {}
+        value = request.COOKIES.get(constants.STATE_COOKIE_NAME)
+        if value:
+            try:
+                state = signing.loads(value, salt=STATE_SALT,
+                                      max_age=_state_max_age())
+            except signing.BadSignature:
+                pass
+        request._oauth_state = state
+    return request._oauth_state
+
+
+def _save_state(request, response):
+    """
+    Write the flow state of ``request`` back into the state cookie if it was
+    changed.
+    """
+    if not getattr(request, '_oauth_state_changed', False):
+        return
+
+    state = _get_state(request)
+    if not state:
+        response.delete_cookie(constants.STATE_COOKIE_NAME)
+        return
+
+    response.set_cookie(constants.STATE_COOKIE_NAME,
+                        signing.dumps(state, salt=STATE_SALT, compress=True),
+                        max_age=_state_max_age(),
+                        secure=request.is_secure(),
+                        httponly=True)
+
+
 class OAuthView(TemplateView):
     """
     Base class for any view dealing with the OAuth flow. This class overrides
@@ -53,6 +101,7 @@ class OAuthView(TemplateView):
         response = super(OAuthView, self).dispatch(request, *args, **kwargs)
         response['Cache-Control'] = 'no-store'
         response['Pragma'] = 'no-cache'
+        _save_state(request, response)
         return response
 
 
@@ -65,8 +114,13 @@ class Mixin(object):
         """
         Return stored data from the session store.
 
+        With :attr:`provider.constants.SESSIONLESS_AUTHORIZATION` set, the data
+        is read from a signed, compressed and expiring cookie instead.
+
         :param key: `str` The key under which the data was stored.
         """
+        if constants.SESSIONLESS_AUTHORIZATION:
+            return _get_state(request).get(key)
         return request.session.get('{}:{}'.format(constants.SESSION_KEY, key))
 
     def cache_data(self, request, data, key='params'):
@@ -77,12 +131,20 @@ class Mixin(object):
         :param data: Arbitrary data to store.
         :param key: `str` The key under which to store the data.
         """
+        if constants.SESSIONLESS_AUTHORIZATION:
+            _get_state(request)[key] = data
+            request._oauth_state_changed = True
+            return
         request.session['{}:{}'.format(constants.SESSION_KEY, key)] = data
 
     def clear_data(self, request):
         """
         Clear all OAuth related data from the session store.
         """
+        if constants.SESSIONLESS_AUTHORIZATION:
+            request._oauth_state = {}
+            request._oauth_state_changed = True
+            return
         for key in request.session.keys():
             if key.startswith(constants.SESSION_KEY):
                 del request.session[key]
@@ -213,6 +275,17 @@ class Authorize(OAuthView, Mixin):
         """
         raise NotImplementedError
 
+    def is_already_authorized(self, request, client, data):
+        """
+        Return ``True`` if the resource owner already authorized ``client``
+        for the requested scope, in which case the authorization form is
+        skipped.
+        """
+        return AccessTokenModel.objects.filter(client=client,
+                                               user=request.user,
+                                               scope=data.get('scope'),
+                                               expires__gte=now()).exists()
+
     def _validate_client(self, request, data):
         """
         :return: ``tuple`` - ``(client or False, data or error)``
@@ -300,11 +373,7 @@ class Authorize(OAuthView, Mixin):
 
         already_authorized = False
         if post_data is None and request.user.is_authenticated():
-            already_authorized = \
-                AccessTokenModel.objects.filter(client=client,
-                                                   user=request.user,
-                                                   scope=data.get('scope'),
-                                                   expires__gte=now()).count() > 0
+            already_authorized = self.is_already_authorized(request, client, data)
             if already_authorized:
                 post_data = {
                     'client_id': str(client.pk),
@@ -325,11 +394,11 @@ class Authorize(OAuthView, Mixin):
         code = self.save_authorization(request, client,
             authorization_form, data)
 
-        # be sure to serialize any objects that aren't natively json
-        # serializable because these values are stored as session data
+        # only store values that are natively json serializable because
+        # these values are stored as session data
         self.cache_data(request, data)
         self.cache_data(request, code, "code")
-        self.cache_data(request, client.serialize(), "client")
+        self.cache_data(request, client.client_id, "client")
 
         response = HttpResponse("", status=302)
         response['Location'] = self.get_redirect_url(request)
@@ -347,8 +416,17 @@ class Redirect(OAuthView, Mixin):
     Redirect the user back to the client with the right query parameters set.
     This can be either parameters indicating success or parameters indicating
     an error.
+
+    Subclasses may override :meth:`get_client` to look clients up elsewhere.
     """
 
+    def get_client(self, client_id):
+        """
+        Return a client object from a given client identifier. Return ``None``
+        if no client is found.
+        """
+        return Client.objects.get_by_client_id(client_id)
+
     def error_response(self, error, content_type='application/json', status=400,
             **kwargs):
         """
@@ -363,13 +441,12 @@ class Redirect(OAuthView, Mixin):
         error = self.get_data(request, "error")
         client = self.get_data(request, "client")
 
-        # client must be properly deserialized to become a valid instance
-        # but only if it has been serialized in the first place
-        try:
+        # the client is referenced by its id, older sessions may still hold
+        # a fully serialized client
+        if isinstance(client, dict):
             client = Client.deserialize(client)
-        except:
-            if not isinstance(client, Client):
-                raise
+        elif client is not None:
+            client = self.get_client(client)
 
         # this is an edge case that is caused by making a request with no data
         # it should only happen if this view is called manually, out of the
@@ -379,7 +456,7 @@ class Redirect(OAuthView, Mixin):
                 'error': 'invalid_data',
                 'error_description': _('Data has not been captured')})
 
-        redirect_uri = data.get('redirect_uri', None) or client.redirect_uri.split(" ")[0]
+        redirect_uri = data.get('redirect_uri', None) or client.redirect_uris.default
 
         parsed = urlparse.urlparse(redirect_uri)
 
@@ -487,6 +564,24 @@ class AccessToken(OAuthView, Mixin):
         """
         raise NotImplementedError
 
+    def get_issued_access_token(self, request, scope, client):
+        """
+        Override to hand out a previously issued client credentials token for
+        the same client and scope instead of creating a new one.
+
+        :return: ``object`` - Access token or ``None``
+        """
+        return None
+
+    def remember_issued_access_token(self, request, access_token):
+        """
+        Override to remember a client credentials token for
+        :meth:`get_issued_access_token`.
+
+        :return None:
+        """
+        pass
+
     def create_access_token(self, request, user, scope, client):
         """
         Override to handle access token creation.
@@ -495,6 +590,17 @@ class AccessToken(OAuthView, Mixin):
         """
         raise NotImplementedError
 
+    def create_refreshed_access_token(self, request, refresh_token, client):
+        """
+        Override to handle creation of the access token replacing the one
+        bound to ``refresh_token``, e.g. to keep both in the same token
+        family.
+
+        :return: ``object`` - Access token
+        """
+        return self.create_access_token(request, refresh_token.user,
+                refresh_token.access_token.scope, client)
+
     def create_refresh_token(self, request, user, scope, access_token, client):
         """
         Override to handle refresh token creation.
@@ -503,12 +609,24 @@ class AccessToken(OAuthView, Mixin):
         """
         raise NotImplementedError
 
+    def claim_refresh_token(self, refresh_token):
+        """
+        Override to invalidate ``refresh_token`` with a conditional update
+        so that only one of several concurrent requests rotating the same
+        refresh token succeeds. Called within a transaction.
+
+        :return: ``bool`` - ``False`` if the token was claimed already
+        """
+        self.invalidate_refresh_token(refresh_token)
+        return True
+
     def update_refresh_token(self, refresh_token, access_token):
         """
         Override to handle refresh token updating. Bind the access token to
         the refresh token.
 
-        :return None:
+        :return: ``False`` if the refresh token was bound to another access
+            token in the meantime, which rolls the rotation back.
         """
         raise NotImplementedError
 
@@ -557,6 +675,38 @@ class AccessToken(OAuthView, Mixin):
         """
         return JsonResponse(error, status=status, **kwargs)
 
+    def overloaded_response(self):
+        """
+        Return a *503* error response telling the client to retry later when
+        too many credentials are being verified at once.
+        """
+        response = self.error_response({
+            'error': 'temporarily_unavailable',
+            'error_description': _("Too many requests are being processed. "
+                "Try again later.")}, status=503)
+        response['Retry-After'] = '1'
+        return response
+
+    def throttled_response(self, retry_after):
+        """
+        Return a *429* error response as outlined in :rfc:`6585#section-4`
+        telling the client to retry after ``retry_after`` seconds.
+        """
+        response = self.error_response({
+            'error': 'temporarily_unavailable',
+            'error_description': _("Too many requests. Try again later.")},
+            status=429)
+        response['Retry-After'] = '{:d}'.format(int(math.ceil(retry_after)))
+        return response
+
+    def login_blocked_response(self):
+        """
+        Return the error response for password grants rejected because of too
+        many failed login attempts.
+        """
+        window = constants.LOGIN_FAILURE_WINDOW
+        return self.throttled_response(window.days * 86400 + window.seconds)
+
     def access_token_response(self, access_token):
         """
         Returns a successful response after creating the access token
@@ -606,17 +756,19 @@ class AccessToken(OAuthView, Mixin):
         """
         rt = self.get_refresh_token_grant(request, data, client)
 
-        # this must be called first in case we need to purge expired tokens
-        if not constants.KEEP_REFRESH_TOKEN:
-            self.invalidate_refresh_token(rt)
-        self.invalidate_access_token(rt.access_token)
+        with transaction.atomic():
+            # this must be called first in case we need to purge expired tokens
+            if not constants.KEEP_REFRESH_TOKEN:
+                if not self.claim_refresh_token(rt):
+                    raise OAuthError({'error': 'invalid_grant'})
+            self.invalidate_access_token(rt.access_token)
 
-        at = self.create_access_token(request, rt.user, rt.access_token.scope,
-                client)
-        if not constants.KEEP_REFRESH_TOKEN:
-            rt = self.create_refresh_token(request, at.user, at.scope, at, client)
-        else:
-            self.update_refresh_token(rt, at)
+            at = self.create_refreshed_access_token(request, rt, client)
+            if not constants.KEEP_REFRESH_TOKEN:
+                rt = self.create_refresh_token(request, at.user, at.scope, at,
+                        client)
+            elif self.update_refresh_token(rt, at) is False:
+                raise OAuthError({'error': 'invalid_grant'})
 
         return self.access_token_response(at)
 
@@ -624,18 +776,25 @@ class AccessToken(OAuthView, Mixin):
         """
         Handle ``grant_type=password`` requests as defined in :rfc:`4.3`.
         """
+        if throttling.login_blocked(request, data, client):
+            return self.login_blocked_response()
 
         try:
-            data = self.get_password_grant(request, data, client)
+            with throttling.password_hashing():
+                grant = self.get_password_grant(request, data, client)
+        except throttling.Overloaded:
+            return self.overloaded_response()
         except OAuthError, e:
+            if e.args[0].get('error') in throttling.LOGIN_FAILURE_ERRORS:
+                throttling.record_login_failure(request, data, client)
             status = 400
             if e.args[0]['error'] == 'invalid_credentials':
                 status = 401
             elif e.args[0]['error'] == 'invalid_scope':
                 status = 403
             return self.error_response(e.args[0], status=status)
-        user = data.get('user')
-        scope = data.get('scope')
+        user = grant.get('user')
+        scope = grant.get('scope')
 
         if constants.SINGLE_ACCESS_TOKEN:
             at = self.get_access_token(request, user, scope, client)
@@ -654,10 +813,20 @@ class AccessToken(OAuthView, Mixin):
         """
         Handle ``grant_type=email_and_password`` requests.
         """
+        if throttling.login_blocked(request, data, client):
+            return self.login_blocked_response()
 
-        data = self.get_email_and_password_grant(request, data, client)
-        user = data.get('user')
-        scope = data.get('scope')
+        try:
+            with throttling.password_hashing():
+                grant = self.get_email_and_password_grant(request, data, client)
+        except throttling.Overloaded:
+            return self.overloaded_response()
+        except OAuthError, e:
+            if e.args[0].get('error') in throttling.LOGIN_FAILURE_ERRORS:
+                throttling.record_login_failure(request, data, client)
+            raise
+        user = grant.get('user')
+        scope = grant.get('scope')
 
         if constants.SINGLE_ACCESS_TOKEN:
             at = self.get_access_token(request, user, scope, client)
@@ -677,6 +846,11 @@ class AccessToken(OAuthView, Mixin):
         data = self.get_client_credentials_grant(request, data, client)
         scope = data.get('scope')
 
+        at = self.get_issued_access_token(request, scope, client)
+
+        if at is not None:
+            return self.access_token_response(at)
+
         # Client credentials should operate on public data and the
         # client only -- exposing the user has the potential to compromise
         # other assets associated with the user but not necessarily the client
@@ -685,6 +859,8 @@ class AccessToken(OAuthView, Mixin):
         else:
             at = self.create_access_token(request, None, scope, client)
 
+        self.remember_issued_access_token(request, at)
+
         return self.access_token_response(at)
 
     def get_handler(self, grant_type):
@@ -739,6 +915,11 @@ class AccessToken(OAuthView, Mixin):
         if client is None:
             return self.error_response({'error': 'invalid_client'}, status=404)
 
+        retry_after = throttling.client_rate_limited(client)
+
+        if retry_after:
+            return self.throttled_response(retry_after)
+
         handler = self.get_handler(grant_type)
 
         try:
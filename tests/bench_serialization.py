@@ -0,0 +1,39 @@
+"""
+Micro benchmark for the session serialization of clients used by the
+authorization flow. Run from the repository root with::
+
+    $ python -m tests.bench_serialization
+"""
+from __future__ import print_function
+
+import os
+import timeit
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.settings")
+
+import django
+django.setup()
+
+from django.contrib.auth import get_user_model
+
+from provider.oauth2.models import Client
+from provider.utils import now
+
+
+def main(number=10000):
+    user = get_user_model()(pk=1, username='bench', email='bench@example.com',
+                            date_joined=now(), last_login=now())
+    client = Client(user=user, name='bench', url='http://example.com/',
+                    redirect_uri='http://example.com/application/1/',
+                    client_id='client-id', client_secret='client-secret',
+                    client_type=0)
+    data = client.serialize()
+
+    for name, func in (('Client.serialize', client.serialize),
+                       ('Client.deserialize', lambda: Client.deserialize(data))):
+        seconds = timeit.timeit(func, number=number)
+        print('{:<20} {:8.2f} us/call'.format(name, seconds / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()